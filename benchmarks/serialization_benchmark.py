@@ -0,0 +1,89 @@
+"""Per-ride cost of serializing a ride list response, before and after the TypeAdapter fast path.
+
+Run from the repository root:
+
+    python benchmarks/serialization_benchmark.py [number_of_rides]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Settings are loaded on import; the values are irrelevant here
+os.environ.setdefault("PORT", "8000")
+os.environ.setdefault("DATABASE_URL", "https://example.invalid")
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from models import Ride
+from services.serialization import RIDE_LIST_ADAPTER
+
+def make_ride(index):
+    start = datetime(2025, 1, 6, 7, 30) + timedelta(minutes=index % 120)
+    location = lambda: {"latitude": random.uniform(40.3, 40.5), "longitude": random.uniform(-3.8, -3.6)}
+    return {
+        "availableSeats": 2,
+        "createdAt": start - timedelta(days=3),
+        "driverId": f"driver_{index % 50}",
+        "daysOfWeek": ["monday", "wednesday", "friday"],
+        "endLocation": location(),
+        "endTime": start + timedelta(minutes=45),
+        # Roughly the size of a 20 km route polyline
+        "ridePolyline": "".join(random.choice("?@ABCDEFGHIJKLMNOPQRSTUVWXYZ_`abcdefghijklmnopqrstuvwxyz") for _ in range(1500)),
+        "rideId": f"ride_{index}",
+        "riders": {
+            f"rider_{index}_{n}": {
+                "dropoffLocation": location(),
+                "pickupLocation": location(),
+                "requestId": f"req_{index}_{n}",
+                "rideStatus": "approved",
+            }
+            for n in range(2)
+        },
+        "startLocation": location(),
+        "startTime": start,
+        "status": "active",
+        "totalSeats": 4,
+        "updatedAt": start - timedelta(days=1),
+    }
+
+def before(documents, response_field):
+    # model_validate + model_dump per document, then FastAPI validates against
+    # response_model=List[Ride] and encodes with jsonable_encoder + json.dumps
+    rides = [Ride.model_validate(document).model_dump() for document in documents]
+    content = asyncio.run(serialize_response(field=response_field, response_content=rides))
+    return JSONResponse(content).body
+
+def after(documents):
+    return RIDE_LIST_ADAPTER.dump_json(RIDE_LIST_ADAPTER.validate_python(documents))
+
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    random.seed(0)
+    documents = [make_ride(index) for index in range(count)]
+    response_field = create_model_field(name="Response_get_rides", type_=List[Ride], mode="serialization")
+
+    assert RIDE_LIST_ADAPTER.validate_json(before(documents, response_field)) == \
+        RIDE_LIST_ADAPTER.validate_json(after(documents)), "both paths must produce the same rides"
+
+    before_seconds = best_of(lambda: before(documents, response_field))
+    after_seconds = best_of(lambda: after(documents))
+    print(f"{count} rides")
+    print(f"before: {before_seconds / count * 1e6:8.1f} us/ride")
+    print(f"after:  {after_seconds / count * 1e6:8.1f} us/ride ({before_seconds / after_seconds:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
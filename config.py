@@ -4,6 +4,31 @@ from pydantic import ConfigDict
 class Settings(BaseSettings):
     PORT: int
     DATABASE_URL: str
+    ROUTE_MATRIX_MAX_ELEMENTS: int = 625
+    WALK_CANDIDATES_PER_SIDE: int = 25
+    WALK_MAX_STRAIGHT_LINE_METERS: float = 2000.0
+    ROUTE_CACHE_PATH: str = "route_cache.sqlite3"
+    ROUTE_CACHE_PRECISION: int = 5
+    ROUTE_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    ROUTE_CACHE_MAX_MEMORY_ENTRIES: int = 10000
+    ROUTES_MAX_IN_FLIGHT: int = 16
+    ROUTES_QPS: float = 50.0
+    ROUTES_BURST: int = 50
+    ROUTES_MAX_RETRIES: int = 4
+    ROUTES_BACKOFF_BASE_SECONDS: float = 0.5
+    ROUTES_BACKOFF_MAX_SECONDS: float = 8.0
+    ROUTES_DEADLINE_SECONDS: float = 10.0
+    COMMUTE_EVAL_CONCURRENCY: int = 8
+    SPATIAL_INDEX_CELL_METERS: float = 500.0
+    RIDE_STORE_ENABLED: bool = True
+    RIDE_STORE_READY_TIMEOUT_SECONDS: float = 30.0
+    RIDE_STORE_RESUBSCRIBE_SECONDS: float = 5.0
+    TRANSACTION_MAX_ATTEMPTS: int = 8
+    TRANSACTION_BACKOFF_BASE_SECONDS: float = 0.05
+    TRANSACTION_BACKOFF_MAX_SECONDS: float = 1.0
+    SCHEDULE_TOLERANCE_MINUTES: int = 30
+    COMMUTE_JOB_WORKERS: int = 2
+    COMMUTE_JOB_PROGRESS_INTERVAL_SECONDS: float = 2.0
 
     model_config = ConfigDict(env_file='.env')
 
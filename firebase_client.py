@@ -1,10 +1,16 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 from config import settings
 from google.maps import routing_v2
 from google.oauth2 import service_account
+from services.route_cache import RouteCache
+from services.routes_client import QuotaAwareRoutesClient
+from services.spatial_index import RideSpatialIndex, CommuteEndpointIndex
+from services.ride_store import RideStore
+from services.commute_jobs import CommuteJobQueue
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -14,40 +20,114 @@ async def lifespan(app: FastAPI):
         firebase_app = firebase_admin.initialize_app(cred, {
             'databaseURL': settings.DATABASE_URL
         })
-        db = firestore.client(app=firebase_app, database_id="rides")
+        db = firestore_async.client(app=firebase_app, database_id="rides")
         rides_ref = db.collection("rides")
         requests_ref = db.collection("ride_requests")
         commutes_ref = db.collection("commutes")
+        ride_distances_ref = db.collection("commute_ride_distances")
+        commute_jobs_ref = db.collection("commute_jobs")
         print("Firebase Admin SDK initialized successfully.")
 
+        ride_index = RideSpatialIndex(cell_size_meters=settings.SPATIAL_INDEX_CELL_METERS)
+        ride_store = None
+        if settings.RIDE_STORE_ENABLED:
+            # Snapshot listeners are only available on the synchronous client
+            ride_store = RideStore(ride_index, resubscribe_interval_seconds=settings.RIDE_STORE_RESUBSCRIBE_SECONDS)
+            listener_db = firestore.client(app=firebase_app, database_id="rides")
+            ride_store.start(listener_db.collection("rides"), asyncio.get_running_loop())
+            try:
+                await ride_store.wait_ready(settings.RIDE_STORE_READY_TIMEOUT_SECONDS)
+                print(f"Ride store loaded with {len(ride_store)} rides.")
+            except asyncio.TimeoutError:
+                print("Ride store not loaded yet, reads fall back to Firestore until it is.")
+        if ride_store is None or not ride_store.ready:
+            async for doc in rides_ref.stream():
+                ride_index.add_ride(doc.id, doc.to_dict())
+        print(f"Ride spatial index built with {len(ride_index)} rides.")
+
+        commute_index = CommuteEndpointIndex(cell_size_meters=settings.SPATIAL_INDEX_CELL_METERS)
+        async for doc in commutes_ref.stream():
+            commute_data = doc.to_dict()
+            try:
+                commute_index.add_commute(
+                    doc.id,
+                    (commute_data["startLocation"]["latitude"], commute_data["startLocation"]["longitude"]),
+                    (commute_data["endLocation"]["latitude"], commute_data["endLocation"]["longitude"])
+                )
+            except (KeyError, TypeError):
+                print(f"Skipping commute {doc.id} without valid endpoints")
+        print(f"Commute endpoint index built with {len(commute_index)} commutes.")
+
         routes_credentials = service_account.Credentials.from_service_account_file(
             'credentials.json',
             scopes=['https://www.googleapis.com/auth/cloud-platform']
         )
-        routes_client = routing_v2.RoutesAsyncClient(credentials=routes_credentials)
+        routes_client = QuotaAwareRoutesClient(
+            routing_v2.RoutesAsyncClient(credentials=routes_credentials),
+            max_in_flight=settings.ROUTES_MAX_IN_FLIGHT,
+            qps=settings.ROUTES_QPS,
+            burst=settings.ROUTES_BURST,
+            max_retries=settings.ROUTES_MAX_RETRIES,
+            backoff_base_seconds=settings.ROUTES_BACKOFF_BASE_SECONDS,
+            backoff_max_seconds=settings.ROUTES_BACKOFF_MAX_SECONDS,
+            deadline_seconds=settings.ROUTES_DEADLINE_SECONDS
+        )
         print("Google Maps Routes API client initialized successfully.")
     except Exception as e:
         print(f"Error initializing Firebase Admin SDK: {e}")
         rides_ref = None
         requests_ref = None
         commutes_ref = None
+        ride_distances_ref = None
+        commute_jobs_ref = None
         db = None
         firebase_app = None
+        routes_client = None
+        ride_index = None
+        ride_store = None
+        commute_index = None
 
     app.state.rides_ref = rides_ref
     app.state.requests_ref = requests_ref
     app.state.commutes_ref = commutes_ref
+    app.state.ride_distances_ref = ride_distances_ref
     app.state.db = db
     app.state.firebase_app = firebase_app
     app.state.routes_client = routes_client
+    app.state.ride_index = ride_index
+    app.state.ride_store = ride_store
+    app.state.commute_index = commute_index
+    app.state.route_cache = RouteCache(
+        settings.ROUTE_CACHE_PATH,
+        precision=settings.ROUTE_CACHE_PRECISION,
+        ttl_seconds=settings.ROUTE_CACHE_TTL_SECONDS,
+        max_memory_entries=settings.ROUTE_CACHE_MAX_MEMORY_ENTRIES
+    )
+
+    app.state.commute_jobs = None
+    if commute_jobs_ref is not None:
+        commute_jobs = CommuteJobQueue(
+            app, commute_jobs_ref,
+            workers=settings.COMMUTE_JOB_WORKERS,
+            progress_interval_seconds=settings.COMMUTE_JOB_PROGRESS_INTERVAL_SECONDS
+        )
+        try:
+            resumed = await commute_jobs.start()
+            app.state.commute_jobs = commute_jobs
+            print(f"Commute job workers started, {resumed} interrupted jobs resumed.")
+        except Exception as e:
+            await commute_jobs.stop()
+            print(f"Error starting commute job workers: {e}")
     yield
 
     # --- Shutdown ---
+    if app.state.commute_jobs is not None:
+        await app.state.commute_jobs.stop()
+    print(f"Route cache stats: {app.state.route_cache.stats()}")
+    app.state.route_cache.close()
+    if app.state.ride_store is not None:
+        app.state.ride_store.stop()
     try:
-        if db:
-            print("Closing Firestore client...")
-            db.close()
-            print("Firestore client closed.")
         if firebase_app:
             firebase_admin.delete_app(firebase_app)
             print("Firebase Admin SDK app deleted successfully.")
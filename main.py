@@ -1,7 +1,8 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from config import settings
 from firebase_client import lifespan
 from routes import ride_routes, commute_routes, request_routes
+from services import metrics
 import logging
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +21,13 @@ app = FastAPI(
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    return {
+        "counters": metrics.snapshot(),
+        "route_cache": request.app.state.route_cache.stats(),
+    }
+
 app.include_router(ride_routes.router, tags=["Rides"])
 app.include_router(commute_routes.router, tags=["Commutes"])
 app.include_router(request_routes.router, tags=["Requests"])
@@ -29,6 +29,7 @@ class RideDistance(BaseModel):
     exit_point: Location | None = None
     exit_polyline: str | None = None
     ride_id: str
+    riding_distance: float | None = None
 
 class Ride(BaseModel):
     """A ride offered by a driver"""
@@ -72,6 +73,18 @@ class Commute(BaseModel):
         }
     }
 
+class CommuteJob(BaseModel):
+    """Background computation of a commute's ride distances"""
+    commuteId: str
+    createdAt: datetime = Field(default_factory=datetime.now)
+    error: str | None = None
+    jobId: str = Field(default_factory=lambda: f"job_{uuid4().hex}")
+    ridesEvaluated: int = 0
+    ridesTotal: int | None = None
+    status: Literal["queued", "running", "completed", "failed"] = "queued"
+    updatedAt: datetime = Field(default_factory=datetime.now)
+    userId: str
+
 class RideRequest(BaseModel):
     """Request from a rider to join a ride"""
     createdAt: datetime = Field(default_factory=datetime.now)
@@ -82,4 +95,22 @@ class RideRequest(BaseModel):
     rideId: str
     riderId: str
     status: RideRequestStatus = RideRequestStatus.PENDING
-    updatedAt: datetime = Field(default_factory=datetime.now)
\ No newline at end of file
+    updatedAt: datetime = Field(default_factory=datetime.now)
+
+class RequestDecision(BaseModel):
+    """Target status for one ride request in a bulk decision"""
+    requestId: str
+    status: Literal[RideRequestStatus.APPROVED, RideRequestStatus.REJECTED]
+
+class BulkRequestDecision(BaseModel):
+    """Approve or reject several requests for one ride at once"""
+    # One transaction holds at most 500 writes: one per request plus the ride
+    decisions: List[RequestDecision] = Field(min_length=1, max_length=499)
+    rideId: str
+
+class RequestDecisionResult(BaseModel):
+    """Outcome of one request in a bulk decision"""
+    message: str
+    requestId: str
+    status: RideRequestStatus | None = None
+    success: bool
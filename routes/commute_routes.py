@@ -1,10 +1,34 @@
 from fastapi import APIRouter, HTTPException, Request
-from models import Commute
-from services.commute_service import create_new_commute, update_commute
+from models import Commute, CommuteJob
+from services.commute_service import create_new_commute, update_commute, COMMUTE_FIELDS
 from datetime import datetime
+from .streaming import wants_ndjson, ndjson_response
 
 router = APIRouter()
 
+async def _stream_user_commutes(commutes_ref, user_id: str):
+    """Yield a user's commutes as they are read, skipping documents that fail to process"""
+    commute_docs = commutes_ref.where("userId", "==", user_id).select(COMMUTE_FIELDS).stream()
+
+    async for doc in commute_docs:
+        try:
+            commute_data = doc.to_dict()
+            # Handle datetime fields
+            timestamp_fields = ["preferredStartTime", "preferredEndTime", "createdAt", "updatedAt"]
+            for field in timestamp_fields:
+                if field in commute_data:
+                    # Handle Firestore timestamps
+                    value = commute_data[field]
+                    if hasattr(value, 'seconds'):  # Firestore timestamp
+                        commute_data[field] = datetime.fromtimestamp(value.seconds + (value.nanos / 1e9))
+        
+            # Validate the commute
+            commute_obj = Commute.model_validate(commute_data)
+        except Exception:
+            # Skip documents that fail to process
+            continue
+        yield commute_obj
+
 @router.get("/commutes/")
 async def get_commutes(request: Request):
     commutes_ref = request.app.state.commutes_ref
@@ -14,40 +38,20 @@ async def get_commutes(request: Request):
     user_id = request.headers.get("X-User-ID")
     if not user_id:
         raise HTTPException(status_code=401, detail="Missing user ID")
+
+    if wants_ndjson(request):
+        return ndjson_response(_stream_user_commutes(commutes_ref, user_id))
     
     try:
-        commutes = []
-        commute_docs = commutes_ref.where("userId", "==", user_id).stream()
-        
-        for doc in commute_docs:
-            try:
-                commute_data = doc.to_dict()
-                # Handle datetime fields
-                timestamp_fields = ["preferredStartTime", "preferredEndTime", "createdAt", "updatedAt"]
-                for field in timestamp_fields:
-                    if field in commute_data:
-                        # Handle Firestore timestamps
-                        value = commute_data[field]
-                        if hasattr(value, 'seconds'):  # Firestore timestamp
-                            commute_data[field] = datetime.fromtimestamp(value.seconds + (value.nanos / 1e9))
-                
-                # Validate and append the commute
-                commute_obj = Commute.model_validate(commute_data)
-                commutes.append(commute_obj)
-            except Exception:
-                # Skip documents that fail to process
-                continue
-        
-        return commutes
+        return [commute async for commute in _stream_user_commutes(commutes_ref, user_id)]
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving commutes: {exc}")
 
-@router.post("/commutes/", response_model=Commute)
+@router.post("/commutes/", response_model=CommuteJob, status_code=202)
 async def create_commute(commute: Commute, request: Request):
     commutes_ref = request.app.state.commutes_ref
-    rides_ref = request.app.state.rides_ref
     
-    if not commutes_ref or not rides_ref:
+    if not commutes_ref or not request.app.state.commute_jobs:
         raise HTTPException(status_code=500, detail="Firestore not initialized")
     
     user_id = request.headers.get("X-User-ID")
@@ -55,18 +59,17 @@ async def create_commute(commute: Commute, request: Request):
         raise HTTPException(status_code=403, detail="You can only create commutes for yourself")
     
     try:
-        return await create_new_commute(commute, commutes_ref, rides_ref, request)
+        return await create_new_commute(commute, commutes_ref, request.app)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error creating commute: {exc}")
 
-@router.put("/commutes/{commute_id}", response_model=Commute)
+@router.put("/commutes/{commute_id}", response_model=CommuteJob, status_code=202)
 async def update_commute_endpoint(commute_id: str, commute_update: Commute, request: Request):
     commutes_ref = request.app.state.commutes_ref
-    rides_ref = request.app.state.rides_ref
     
-    if not commutes_ref:
+    if not commutes_ref or not request.app.state.commute_jobs:
         raise HTTPException(status_code=500, detail="Firestore not initialized")
     
     user_id = request.headers.get("X-User-ID")
@@ -78,8 +81,29 @@ async def update_commute_endpoint(commute_id: str, commute_update: Commute, requ
         raise HTTPException(status_code=400, detail="Commute ID in path must match commute ID in body")
     
     try:
-        return await update_commute(commute_id, commute_update, commutes_ref, rides_ref, request)
+        return await update_commute(commute_id, commute_update, commutes_ref, request.app)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error updating commute: {exc}")
+
+@router.get("/commutes/{commute_id}/status", response_model=CommuteJob)
+async def get_commute_status(commute_id: str, request: Request):
+    commute_jobs = request.app.state.commute_jobs
+    if not commute_jobs:
+        raise HTTPException(status_code=500, detail="Firestore not initialized")
+    
+    user_id = request.headers.get("X-User-ID")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+    
+    try:
+        job = await commute_jobs.get(commute_id)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Error retrieving commute status: {exc}")
+
+    if not job:
+        raise HTTPException(status_code=404, detail=f"No job found for commute {commute_id}")
+    if job.userId != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized to view this commute")
+    return job
@@ -1,10 +1,14 @@
 from fastapi import APIRouter, HTTPException, Request
 from typing import List
-from models import RideRequest, RideRequestStatus
+from models import RideRequest, RideRequestStatus, BulkRequestDecision, RequestDecisionResult
 from services.request_service import (
-    create_ride_request, handle_ride_request,
-    get_ride_requests_by_rider, get_ride_requests_by_driver, get_ride_request_by_id
+    create_ride_request, handle_ride_request, handle_ride_requests_bulk,
+    get_ride_requests_by_rider, get_ride_requests_by_driver, get_ride_request_by_id,
+    stream_ride_requests_by_driver
 )
+from services.serialization import RIDE_REQUEST_LIST_ADAPTER
+from services.transactions import TransactionContentionError
+from .streaming import wants_ndjson, ndjson_response, json_list_response
 
 router = APIRouter()
 
@@ -19,7 +23,7 @@ async def get_rider_requests(rider_id: str, request: Request):
         raise HTTPException(status_code=403, detail="Unauthorized to view these requests")
     
     try:
-        return await get_ride_requests_by_rider(rider_id, requests_ref)
+        return json_list_response(RIDE_REQUEST_LIST_ADAPTER, await get_ride_requests_by_rider(rider_id, requests_ref))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving requests: {exc}")
 
@@ -33,8 +37,11 @@ async def get_driver_requests(driver_id: str, request: Request):
     if not user_id or user_id != driver_id:
         raise HTTPException(status_code=403, detail="Unauthorized to view these requests")
     
+    if wants_ndjson(request):
+        return ndjson_response(stream_ride_requests_by_driver(driver_id, requests_ref))
+
     try:
-        return await get_ride_requests_by_driver(driver_id, requests_ref)
+        return json_list_response(RIDE_REQUEST_LIST_ADAPTER, await get_ride_requests_by_driver(driver_id, requests_ref))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving requests: {exc}")
 
@@ -81,6 +88,28 @@ async def request_ride(request_data: RideRequest, request: Request):
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error creating ride request: {exc}")
 
+@router.put("/requests/bulk", response_model=List[RequestDecisionResult])
+async def handle_requests_bulk(decision: BulkRequestDecision, request: Request):
+    rides_ref = request.app.state.rides_ref
+    requests_ref = request.app.state.requests_ref
+    if not rides_ref or not requests_ref:
+        raise HTTPException(status_code=500, detail="Firestore not initialized")
+    
+    user_id = request.headers.get("X-User-ID")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Missing user ID")
+    
+    try:
+        return await handle_ride_requests_bulk(
+            decision.rideId, user_id, decision.decisions, rides_ref, requests_ref, request.app.state.db
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TransactionContentionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Error handling requests: {exc}")
+
 @router.put("/requests/{request_id}/approve")
 async def approve_request(request_id: str, request: Request):
     rides_ref = request.app.state.rides_ref
@@ -93,9 +122,13 @@ async def approve_request(request_id: str, request: Request):
         raise HTTPException(status_code=401, detail="Missing user ID")
     
     try:
-        return await handle_ride_request(request_id, user_id, RideRequestStatus.APPROVED, rides_ref, requests_ref)
+        return await handle_ride_request(
+            request_id, user_id, RideRequestStatus.APPROVED, rides_ref, requests_ref, request.app.state.db
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except TransactionContentionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error approving request: {exc}")
 
@@ -111,8 +144,12 @@ async def reject_request(request_id: str, request: Request):
         raise HTTPException(status_code=401, detail="Missing user ID")
     
     try:
-        return await handle_ride_request(request_id, user_id, RideRequestStatus.REJECTED, rides_ref, requests_ref)
+        return await handle_ride_request(
+            request_id, user_id, RideRequestStatus.REJECTED, rides_ref, requests_ref, request.app.state.db
+        )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except TransactionContentionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error rejecting request: {exc}")
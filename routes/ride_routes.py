@@ -1,26 +1,58 @@
-from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi import APIRouter, HTTPException, Request, Query, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from typing import List
 from models import Ride, Commute
+from services.commute_service import COMMUTE_FIELDS
 from services.ride_service import (
-    get_all_rides, create_new_ride, get_ride_by_id, update_ride, cancel_ride,
-    get_rides_by_driver, get_rides_for_rider, get_available_rides
+    get_all_rides, get_rides_page, create_new_ride, get_ride_by_id, update_ride, cancel_ride, cancel_future_rides,
+    get_rides_by_driver, get_rides_for_rider, get_available_rides, stream_all_rides, stream_rides_for_rider
 )
+from services.serialization import RIDE_LIST_ADAPTER
+from .streaming import wants_ndjson, ndjson_response, json_list_response
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 100
+
 @router.get("/", response_model=List[Ride])
-async def get_rides(request: Request):
+async def get_rides(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=1000, description="Page size; all rides are returned when no paging or fields are given"),
+    page_token: str | None = Query(None, description="X-Next-Page-Token of the previous page"),
+    fields: str | None = Query(None, description="Comma-separated ride fields to return, e.g. rideId,startTime")
+):
     rides_ref = request.app.state.rides_ref
     if not rides_ref:
         raise HTTPException(status_code=500, detail="Firestore not initialized")
+
+    field_list = None
+    if fields:
+        field_list = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in field_list if field not in Ride.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown ride fields: {', '.join(unknown)}")
     
     try:
-        return await get_all_rides(rides_ref)
+        if limit is None and page_token is None and field_list is None:
+            if wants_ndjson(request):
+                return ndjson_response(stream_all_rides(rides_ref, request.app.state.ride_store))
+            return json_list_response(RIDE_LIST_ADAPTER, await get_all_rides(rides_ref, request.app.state.ride_store))
+
+        rides, next_page_token = await get_rides_page(
+            rides_ref, limit or DEFAULT_PAGE_SIZE, page_token, field_list, request.app.state.ride_store
+        )
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving rides: {exc}")
 
+    headers = {"X-Next-Page-Token": next_page_token} if next_page_token else {}
+    if field_list is not None:
+        # Partial rides don't fit the Ride response model
+        return JSONResponse(content=jsonable_encoder(rides), headers=headers)
+    return json_list_response(RIDE_LIST_ADAPTER, rides, headers)
+
 @router.post("/", response_model=Ride)
-async def create_ride(ride: Ride, request: Request):
+async def create_ride(ride: Ride, request: Request, background_tasks: BackgroundTasks):
     print("creating ride...")
     rides_ref = request.app.state.rides_ref
     if not rides_ref:
@@ -35,7 +67,7 @@ async def create_ride(ride: Ride, request: Request):
         raise HTTPException(status_code=403, detail="You can only create rides for yourself")
 
     try:
-        return await create_new_ride(ride, rides_ref, request)
+        return await create_new_ride(ride, rides_ref, request, background_tasks)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as exc:
@@ -46,11 +78,10 @@ async def get_available_rides_endpoint(
     request: Request,
     max_distance: float = Query(5.0, description="Maximum walking distance in km")
 ):
-    print(f"getting available rides with max_distance: {max_distance}")
-    print(f"request params: {request._query_params}")
     rides_ref = request.app.state.rides_ref
     commutes_ref = request.app.state.commutes_ref
-    if not rides_ref or not commutes_ref:
+    ride_distances_ref = request.app.state.ride_distances_ref
+    if not rides_ref or not commutes_ref or not ride_distances_ref:
         raise HTTPException(status_code=500, detail="Firestore not initialized")
     
     user_id = request.headers.get("X-User-ID")
@@ -59,16 +90,19 @@ async def get_available_rides_endpoint(
     
     try:
         # Get user's commute
-        commute_docs = commutes_ref.where("userId", "==", user_id).stream()
+        commute_docs = commutes_ref.where("userId", "==", user_id).select(COMMUTE_FIELDS).stream()
         commute = None
-        for doc in commute_docs:
+        async for doc in commute_docs:
             commute = Commute.model_validate(doc.to_dict())
             break
         
         if not commute:
             raise HTTPException(status_code=400, detail="No commute found, please create one first")
         
-        return await get_available_rides(user_id, commute, max_distance, rides_ref, commutes_ref)
+        return await get_available_rides(
+            user_id, commute, max_distance, rides_ref, ride_distances_ref,
+            request.app.state.ride_store, request.app.state.db
+        )
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving available rides: {exc}")
 
@@ -79,7 +113,7 @@ async def get_ride(ride_id: str, request: Request):
         raise HTTPException(status_code=500, detail="Firestore not initialized")
     
     try:
-        ride = await get_ride_by_id(ride_id, rides_ref)
+        ride = await get_ride_by_id(ride_id, rides_ref, request.app.state.ride_store)
         if not ride:
             raise HTTPException(status_code=404, detail=f"Ride {ride_id} not found")
         return ride
@@ -87,7 +121,7 @@ async def get_ride(ride_id: str, request: Request):
         raise HTTPException(status_code=500, detail=f"Error retrieving ride: {exc}")
 
 @router.put("/{ride_id}", response_model=Ride)
-async def update_ride_endpoint(ride_id: str, ride_update: Ride, request: Request):
+async def update_ride_endpoint(ride_id: str, ride_update: Ride, request: Request, background_tasks: BackgroundTasks):
     rides_ref = request.app.state.rides_ref
     
     if not rides_ref:
@@ -102,14 +136,14 @@ async def update_ride_endpoint(ride_id: str, ride_update: Ride, request: Request
         raise HTTPException(status_code=400, detail="Ride ID in path must match ride ID in body")
     
     try:
-        return await update_ride(ride_id, ride_update.model_dump(), rides_ref, request)
+        return await update_ride(ride_id, ride_update.model_dump(), rides_ref, request, background_tasks)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error updating ride: {exc}")
 
 @router.delete("/{ride_id}")
-async def delete_ride(ride_id: str, request: Request):
+async def delete_ride(ride_id: str, request: Request, background_tasks: BackgroundTasks):
     rides_ref = request.app.state.rides_ref
     requests_ref = request.app.state.requests_ref
     if not rides_ref or not requests_ref:
@@ -120,7 +154,7 @@ async def delete_ride(ride_id: str, request: Request):
         raise HTTPException(status_code=401, detail="Missing user ID")
     
     try:
-        result = await cancel_ride(ride_id, user_id, rides_ref, requests_ref)
+        result = await cancel_ride(ride_id, user_id, rides_ref, requests_ref, request, background_tasks)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -138,10 +172,28 @@ async def get_driver_rides(driver_id: str, request: Request):
         raise HTTPException(status_code=403, detail="Unauthorized to view these rides")
     
     try:
-        return await get_rides_by_driver(driver_id, rides_ref)
+        return json_list_response(
+            RIDE_LIST_ADAPTER, await get_rides_by_driver(driver_id, rides_ref, request.app.state.ride_store)
+        )
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving rides: {exc}")
 
+@router.delete("/driver/{driver_id}/future")
+async def cancel_driver_future_rides(driver_id: str, request: Request, background_tasks: BackgroundTasks):
+    rides_ref = request.app.state.rides_ref
+    requests_ref = request.app.state.requests_ref
+    if not rides_ref or not requests_ref:
+        raise HTTPException(status_code=500, detail="Firestore not initialized")
+    
+    user_id = request.headers.get("X-User-ID")
+    if not user_id or user_id != driver_id:
+        raise HTTPException(status_code=403, detail="You can only cancel your own rides")
+    
+    try:
+        return await cancel_future_rides(driver_id, rides_ref, requests_ref, request, background_tasks)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Error cancelling rides: {exc}")
+
 @router.get("/rider/{rider_id}", response_model=List[Ride])
 async def get_rider_rides(rider_id: str, request: Request):
     rides_ref = request.app.state.rides_ref
@@ -152,7 +204,12 @@ async def get_rider_rides(rider_id: str, request: Request):
     if not user_id or user_id != rider_id:
         raise HTTPException(status_code=403, detail="Unauthorized to view these rides")
     
+    if wants_ndjson(request):
+        return ndjson_response(stream_rides_for_rider(rider_id, rides_ref, request.app.state.ride_store))
+
     try:
-        return await get_rides_for_rider(rider_id, rides_ref)
+        return json_list_response(
+            RIDE_LIST_ADAPTER, await get_rides_for_rider(rider_id, rides_ref, request.app.state.ride_store)
+        )
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error retrieving rides: {exc}")
\ No newline at end of file
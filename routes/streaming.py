@@ -0,0 +1,39 @@
+import json
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def wants_ndjson(request: Request):
+    """Whether the client asked for newline-delimited JSON"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(records):
+    """Stream an async iterable of models or dicts, one JSON document per line.
+
+    Lines are sent as records arrive, so nothing is buffered beyond the current
+    record. The status is already sent when a record fails, so the error is
+    reported as a final {"error": ...} line instead.
+    """
+    async def lines():
+        try:
+            async for record in records:
+                if isinstance(record, BaseModel):
+                    yield record.model_dump_json() + "\n"
+                else:
+                    yield json.dumps(jsonable_encoder(record)) + "\n"
+        except Exception as exc:
+            print(f"Error while streaming response: {exc}")
+            yield json.dumps({"error": str(exc)}) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+def json_list_response(adapter, items, headers=None):
+    """Serialize already validated models straight to JSON bytes with a list TypeAdapter.
+
+    Returning a Response skips FastAPI's response_model validation and encoding,
+    which would validate and convert every item again.
+    """
+    return Response(content=adapter.dump_json(items), media_type="application/json", headers=headers)
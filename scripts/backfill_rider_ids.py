@@ -0,0 +1,32 @@
+"""Backfill the riderIds field of ride documents from the keys of their riders map.
+
+get_rides_for_rider queries riderIds with array_contains, so rides written
+before the field existed are invisible to it until this job has run. Rides are
+scanned in pages and only those whose riderIds is missing or out of date are
+rewritten, in write batches; running the job again is safe. Run from the
+repository root:
+
+    python scripts/backfill_rider_ids.py [--page-size 500] [--dry-run]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.batching import rewrite_collection
+from services.ride_service import RIDER_IDS_FIELD, rider_ids
+from scripts.job_runner import run_job
+
+async def backfill(db, page_size, dry_run):
+    async def writes_for(doc):
+        ride_data = doc.to_dict()
+        ids = rider_ids(ride_data.get("riders"))
+        if ride_data.get(RIDER_IDS_FIELD) == ids:
+            return []
+        return [("update", doc.reference, {RIDER_IDS_FIELD: ids})]
+
+    query = db.collection("rides").select(["riders", RIDER_IDS_FIELD])
+    await rewrite_collection(query, writes_for, db, page_size, dry_run, label="rides")
+
+if __name__ == "__main__":
+    run_job(backfill, __doc__.splitlines()[0])
@@ -0,0 +1,23 @@
+"""Command line entry point shared by the one-off data migration scripts."""
+import argparse
+import asyncio
+
+import firebase_admin
+from firebase_admin import credentials, firestore_async
+from config import settings
+
+def run_job(job, description):
+    """Parse --page-size and --dry-run, then run job(db, page_size, dry_run) against Firestore"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--page-size", type=int, default=500, help="Documents read per page")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    firebase_app = firebase_admin.initialize_app(credentials.Certificate("credentials.json"), {
+        "databaseURL": settings.DATABASE_URL
+    })
+    try:
+        db = firestore_async.client(app=firebase_app, database_id="rides")
+        asyncio.run(job(db, args.page_size, args.dry_run))
+    finally:
+        firebase_admin.delete_app(firebase_app)
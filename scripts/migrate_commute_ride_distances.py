@@ -0,0 +1,49 @@
+"""Move the ride distances embedded in commute documents into commute_ride_distances.
+
+Commutes saved before ride distances got their own collection keep them in an
+inline ride_distances list, which get_available_rides no longer reads. Each
+entry becomes a row keyed "<commuteId>__<rideId>" and the inline list is then
+removed, so running the job again is safe. Entries that no longer validate
+are dropped. Run from the repository root:
+
+    python scripts/migrate_commute_ride_distances.py [--page-size 500] [--dry-run]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud.firestore_v1 import DELETE_FIELD
+from pydantic import ValidationError
+from models import RideDistance
+from services.batching import rewrite_collection
+from services.ride_distance_service import ride_distance_doc_id, ride_distance_data
+from scripts.job_runner import run_job
+
+def inline_ride_distances(commute_id, entries):
+    ride_distances = []
+    for entry in entries or []:
+        try:
+            ride_distances.append(RideDistance.model_validate(entry))
+        except ValidationError as e:
+            print(f"Skipping invalid ride distance of commute {commute_id}: {e}")
+    return ride_distances
+
+async def migrate(db, page_size, dry_run):
+    ride_distances_ref = db.collection("commute_ride_distances")
+
+    async def writes_for(doc):
+        commute_data = doc.to_dict()
+        if "ride_distances" not in commute_data:
+            return []
+        # The commute is updated last, so an interrupted run leaves the list in place to retry
+        return [
+            ("set", ride_distances_ref.document(ride_distance_doc_id(doc.id, rd.ride_id)), ride_distance_data(doc.id, rd))
+            for rd in inline_ride_distances(doc.id, commute_data["ride_distances"])
+        ] + [("update", doc.reference, {"ride_distances": DELETE_FIELD})]
+
+    query = db.collection("commutes").select(["ride_distances"])
+    await rewrite_collection(query, writes_for, db, page_size, dry_run, label="commutes")
+
+if __name__ == "__main__":
+    run_job(migrate, __doc__.splitlines()[0])
@@ -0,0 +1,60 @@
+"""Rewrite legacy ride documents so they validate against the current Ride model.
+
+Fixes applied:
+- totalSeats is set from availableSeats when it is missing
+- a rider's rideStatus 'reserved' becomes 'approved'
+- a rider without requestId gets the ID of their ride request, or a
+  deterministic ID derived from the ride and rider when there is none
+
+Rides are scanned in pages and rewritten in write batches. Migrated documents
+no longer match any fix, so running the job again is safe. Run from the
+repository root:
+
+    python scripts/migrate_legacy_rides.py [--page-size 500] [--dry-run]
+"""
+import os
+import sys
+from uuid import NAMESPACE_URL, uuid5
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud.firestore_v1.field_path import FieldPath
+from services.batching import rewrite_collection
+from scripts.job_runner import run_job
+
+def fallback_request_id(ride_id, rider_id):
+    """Same ID on every run for the same ride and rider"""
+    return f"req_{uuid5(NAMESPACE_URL, f'rides/{ride_id}/riders/{rider_id}').hex}"
+
+async def find_request_id(requests_ref, ride_id, rider_id):
+    query = requests_ref.where("rideId", "==", ride_id).where("riderId", "==", rider_id).limit(1)
+    async for doc in query.stream():
+        return doc.id
+    return fallback_request_id(ride_id, rider_id)
+
+async def legacy_ride_updates(ride_id, ride_data, requests_ref):
+    """Field updates that bring a ride document up to date, empty when it already is"""
+    updates = {}
+    if "availableSeats" in ride_data and "totalSeats" not in ride_data:
+        updates["totalSeats"] = ride_data["availableSeats"]
+
+    for rider_id, rider_details in (ride_data.get("riders") or {}).items():
+        if rider_details.get("rideStatus") == "reserved":
+            updates[FieldPath("riders", rider_id, "rideStatus").to_api_repr()] = "approved"
+        if "requestId" not in rider_details:
+            updates[FieldPath("riders", rider_id, "requestId").to_api_repr()] = await find_request_id(
+                requests_ref, ride_id, rider_id
+            )
+    return updates
+
+async def migrate(db, page_size, dry_run):
+    requests_ref = db.collection("ride_requests")
+
+    async def writes_for(doc):
+        updates = await legacy_ride_updates(doc.id, doc.to_dict(), requests_ref)
+        return [("update", doc.reference, updates)] if updates else []
+
+    await rewrite_collection(db.collection("rides"), writes_for, db, page_size, dry_run, label="rides")
+
+if __name__ == "__main__":
+    run_job(migrate, __doc__.splitlines()[0])
@@ -0,0 +1,62 @@
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Firestore caps a write batch at 500 operations
+BATCH_SIZE = 500
+
+async def commit_in_batches(writes, db):
+    """Apply (operation, reference, data) writes in order, BATCH_SIZE per write batch.
+
+    operation is "set", "update" or "delete"; data is ignored for deletes. Each
+    batch lands atomically, and larger sets of writes are split in order.
+    """
+    for start in range(0, len(writes), BATCH_SIZE):
+        batch = db.batch()
+        for operation, ref, data in writes[start:start + BATCH_SIZE]:
+            if operation == "delete":
+                batch.delete(ref)
+            else:
+                getattr(batch, operation)(ref, data)
+        await batch.commit()
+
+async def rewrite_collection(query, writes_for, db, page_size=500, dry_run=False, label="documents"):
+    """Scan query in pages ordered by document ID and apply the writes each document needs.
+
+    writes_for(doc) is awaited and returns the (operation, reference, data) writes
+    for one document, empty when it is already up to date. Writes are committed
+    in batches, keeping a document's writes in one batch when they fit. With
+    dry_run nothing is written. Returns (scanned, rewritten).
+    """
+    scanned = rewritten = 0
+    pending = []
+    last_id = None
+    action = "need rewriting" if dry_run else "rewritten"
+
+    async def flush():
+        if not dry_run:
+            await commit_in_batches(pending, db)
+        pending.clear()
+
+    while True:
+        page = query.order_by(FieldPath.document_id()).limit(page_size)
+        if last_id is not None:
+            page = page.start_after({FieldPath.document_id(): last_id})
+        docs = [doc async for doc in page.stream()]
+        if not docs:
+            break
+
+        for doc in docs:
+            writes = await writes_for(doc)
+            if not writes:
+                continue
+            rewritten += 1
+            if len(pending) + len(writes) > BATCH_SIZE:
+                await flush()
+            pending.extend(writes)
+        scanned += len(docs)
+        last_id = docs[-1].id
+        print(f"Scanned {scanned} {label}, {rewritten} {action}")
+
+    if pending:
+        await flush()
+    print(f"Done: {rewritten} of {scanned} {label} {action}")
+    return scanned, rewritten
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pydantic import ValidationError
+from models import Commute, CommuteJob
+from .commute_service import recompute_ride_distances, COMMUTE_FIELDS
+from .transactions import run_transaction
+
+logger = logging.getLogger(__name__)
+
+class JobSuperseded(Exception):
+    """A newer job was submitted for the same commute"""
+
+class CommuteJobQueue:
+    """Bounded in-process worker pool that computes commute ride distances.
+
+    Jobs are persisted in the commute_jobs collection under their commute's ID,
+    so each commute has one current job whose status survives restarts; jobs
+    left queued or running by a previous process are resumed on start.
+    Submitting a job for a commute supersedes any earlier one, which stops
+    at its next progress update, cancelling its pending ride evaluations,
+    and never writes over the newer job's status or ride distances.
+    """
+
+    def __init__(self, app, jobs_ref, workers=2, progress_interval_seconds=2.0):
+        self.app = app
+        self.jobs_ref = jobs_ref
+        self.workers = workers
+        self.progress_interval_seconds = progress_interval_seconds
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._current = {}
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        resumed = 0
+        async for doc in self.jobs_ref.where("status", "in", ["queued", "running"]).stream():
+            try:
+                job = CommuteJob.model_validate(doc.to_dict())
+            except ValidationError as e:
+                # One unreadable job must not keep the others, or startup, from going ahead
+                logger.error(f"Commute job {doc.id} can't be resumed: {str(e)}")
+                await doc.reference.update({
+                    "status": "failed", "error": f"Invalid job document: {e}", "updatedAt": datetime.now()
+                })
+                continue
+            self._current[job.commuteId] = job.jobId
+            await self._queue.put(job)
+            resumed += 1
+        return resumed
+
+    async def stop(self):
+        # Unfinished jobs stay queued or running in Firestore and are resumed on the next start
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, commute: Commute):
+        """Persist and enqueue a job computing the commute's ride distances"""
+        job = CommuteJob(commuteId=commute.commuteId, userId=commute.userId)
+        await self.jobs_ref.document(commute.commuteId).set(job.model_dump())
+        self._current[commute.commuteId] = job.jobId
+        await self._queue.put(job)
+        return job
+
+    async def get(self, commute_id: str):
+        """Current job of a commute, or None if it never had one"""
+        job_doc = await self.jobs_ref.document(commute_id).get()
+        if not job_doc.exists:
+            return None
+        return CommuteJob.model_validate(job_doc.to_dict())
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"Commute job {job.jobId} crashed: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _is_current(self, job):
+        return self._current.get(job.commuteId) == job.jobId
+
+    async def _update(self, job, **fields):
+        if not self._is_current(job):
+            return
+        job_ref = self.jobs_ref.document(job.commuteId)
+
+        async def apply(transaction):
+            job_doc = await job_ref.get(field_paths=["jobId", "ridesEvaluated"], transaction=transaction)
+            if not job_doc.exists:
+                return
+            stored = job_doc.to_dict()
+            # A newer job may have replaced the document since the check above
+            if stored.get("jobId") != job.jobId:
+                return
+            # Progress updates commit concurrently, so a lower count may arrive after a higher one
+            if "status" not in fields and fields.get("ridesEvaluated", 0) < (stored.get("ridesEvaluated") or 0):
+                return
+            transaction.update(job_ref, {**fields, "updatedAt": datetime.now()})
+
+        await run_transaction(self.app.state.db, apply, "commute_job_update")
+
+    async def _run(self, job):
+        if not self._is_current(job):
+            return
+
+        try:
+            commute_doc = await self.app.state.commutes_ref.document(job.commuteId).get(field_paths=COMMUTE_FIELDS)
+            if not commute_doc.exists:
+                await self._update(job, status="failed", error=f"Commute {job.commuteId} not found")
+                return
+            commute = Commute.model_validate(commute_doc.to_dict())
+
+            await self._update(job, status="running", ridesEvaluated=0, error=None)
+            last_write = 0.0
+            rides_total = 0
+
+            async def ensure_current():
+                if not self._is_current(job):
+                    raise JobSuperseded()
+
+            async def on_progress(evaluated, total):
+                nonlocal last_write, rides_total
+                await ensure_current()
+                rides_total = total
+                # Progress is written at most every progress_interval_seconds, plus at the start and end
+                now = time.monotonic()
+                if evaluated in (0, total) or now - last_write >= self.progress_interval_seconds:
+                    last_write = now
+                    await self._update(job, ridesEvaluated=evaluated, ridesTotal=total)
+
+            await recompute_ride_distances(commute, self.app.state.rides_ref, self.app, on_progress, ensure_current)
+            await self._update(job, status="completed", ridesEvaluated=rides_total, ridesTotal=rides_total)
+            logger.info(f"Commute job {job.jobId} completed")
+        except JobSuperseded:
+            logger.info(f"Commute job {job.jobId} superseded by a newer job")
+        except Exception as e:
+            logger.error(f"Commute job {job.jobId} failed: {str(e)}")
+            await self._update(job, status="failed", error=str(e))
+        finally:
+            if self._is_current(job):
+                del self._current[job.commuteId]
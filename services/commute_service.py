@@ -1,278 +1,318 @@
 from models import Commute, RideDistance, Location
-from datetime import datetime
+from datetime import datetime, timezone
+from config import settings
 from .utils import find_closest_points_on_route_by_walking, get_walking_route_polyline
-from google.maps import routing_v2
+from .routes_client import RoutingUnavailableError
+from .ride_distance_service import replace_ride_distances, upsert_ride_distance, delete_ride_distance
+from .ride_geometry import load_ride_geometry
+from .schedule import schedule_compatible
+import asyncio
 
-import logging 
+import logging
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def create_new_commute(commute: Commute, commutes_ref, rides_ref, request):
-    """Create a new commute and populate it with ride_distances"""
+# Commute document fields; ride distances are stored in their own collection
+COMMUTE_FIELDS = [field for field in Commute.model_fields if field != "ride_distances"]
+
+async def evaluate_ride_for_commute(ride_data: dict, commute: Commute, app):
+    """Compute the RideDistance of one ride for a commute, or None if the ride can't serve it"""
+    client = app.state.routes_client
+    cache = app.state.route_cache
+    ride_id = ride_data.get("rideId")
+
+    # Cheap schedule check before any geometry or Routes API work
+    if not schedule_compatible(ride_data, commute):
+        logger.info(f"Skipping ride {ride_id}: schedule doesn't fit the commute")
+        return None
+
+    # Validate ride data
+    if not ride_data.get('startLocation') or not ride_data.get('endLocation'):
+        logger.warning(f"Skipping ride {ride_id}: Missing location data")
+        return None
+
+    # Extract coordinates
+    start_lat = ride_data.get('startLocation', {}).get('latitude')
+    start_lng = ride_data.get('startLocation', {}).get('longitude')
+    end_lat = ride_data.get('endLocation', {}).get('latitude')
+    end_lng = ride_data.get('endLocation', {}).get('longitude')
+
+    # Validate coordinates
+    if None in [start_lat, start_lng, end_lat, end_lng]:
+        logger.warning(f"Skipping ride {ride_id}: Invalid coordinates")
+        return None
+
+    # Get ride polyline and its pre-sampled geometry
+    encoded_polyline = ride_data.get('ridePolyline')
+    sampled_route = None
+    if encoded_polyline:
+        sampled_route = load_ride_geometry(ride_data, sampling_distance_meters=100)
+    else:
+        logger.warning(f"Ride {ride_id} has no polyline data, may affect route calculation")
+
+    commute_start = (commute.startLocation.latitude, commute.startLocation.longitude)
+    commute_end = (commute.endLocation.latitude, commute.endLocation.longitude)
+
+    logger.info(f"Finding closest points on route for ride {ride_id}")
+    result = await find_closest_points_on_route_by_walking(
+        app=app,
+        origin_A_coord=(start_lat, start_lng),
+        destination_B_coord=(end_lat, end_lng),
+        origin_X_coord=commute_start,
+        destination_Y_coord=commute_end,
+        encoded_polyline=encoded_polyline,
+        sampling_distance_meters=100,
+        sampled_route=sampled_route
+    )
+
+    if not result:
+        logger.warning(f"Could not find route for ride {ride_id}")
+        return None
+
+    entry_point, exit_point, total_walk_distance, route_polyline, riding_distance = result
+
+    # Validate results
+    if not entry_point or not exit_point or total_walk_distance == float('inf'):
+        logger.warning(f"Invalid route calculation for ride {ride_id}")
+        return None
+
+    logger.info(f"Found viable route for ride {ride_id} with walking distance: {total_walk_distance}m")
+
+    # Get both walking polylines at once
+    entry_polyline, exit_polyline = await asyncio.gather(
+        get_walking_route_polyline(client, commute_start, entry_point, cache),
+        get_walking_route_polyline(client, exit_point, commute_end, cache)
+    )
+
+    return RideDistance(
+        ride_id=ride_id,
+        distance=total_walk_distance,
+        entry_point=Location(latitude=entry_point[0], longitude=entry_point[1]),
+        entry_polyline=entry_polyline,
+        exit_point=Location(latitude=exit_point[0], longitude=exit_point[1]),
+        exit_polyline=exit_polyline,
+        riding_distance=riding_distance
+    )
+
+async def compute_ride_distances(commute: Commute, all_rides, app, on_progress=None):
+    """Evaluate every ride for a commute with at most COMMUTE_EVAL_CONCURRENCY rides in flight.
+
+    Results keep the order of all_rides; rides that can't serve the commute are dropped.
+    on_progress(evaluated, total) is awaited after each ride is evaluated.
+    The first RoutingUnavailableError, or error raised by on_progress, cancels
+    the evaluations still pending and is re-raised.
+    """
+    semaphore = asyncio.Semaphore(settings.COMMUTE_EVAL_CONCURRENCY)
+    evaluated = 0
+
+    async def evaluate(index, ride_data):
+        async with semaphore:
+            ride_id = None
+            try:
+                ride_id = ride_data.get("rideId")
+                logger.info(f"Processing ride {index+1}/{len(all_rides)}: {ride_id}")
+                ride_distance = await evaluate_ride_for_commute(ride_data, commute, app)
+                if ride_distance:
+                    logger.info(f"Added ride {ride_id} to viable options")
+            except RoutingUnavailableError:
+                raise
+            except Exception as e:
+                logger.error(f"Error processing ride {ride_id}: {str(e)}")
+                ride_distance = None
+
+        nonlocal evaluated
+        evaluated += 1
+        if on_progress is not None:
+            await on_progress(evaluated, len(all_rides))
+        return ride_distance
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(evaluate(index, ride_data)) for index, ride_data in enumerate(all_rides)]
+    except ExceptionGroup as e:
+        raise e.exceptions[0]
+    return [task.result() for task in tasks if task.result()]
+
+async def fetch_candidate_rides(commute: Commute, rides_ref, app):
+    """Data of the rides passing within walking range of both ends of the commute, ordered by rideId.
+
+    Uses the ride spatial index when it is available, otherwise streams every ride.
+    Ride data comes from the ride store when it is loaded, otherwise from Firestore.
+    """
+    ride_index = app.state.ride_index
+    ride_store = app.state.ride_store
+    if ride_index is None:
+        if ride_store is not None and ride_store.ready:
+            return [dict(ride_data) for _, ride_data in ride_store.items()]
+        docs = [doc async for doc in rides_ref.stream()]
+        return [doc.to_dict() for doc in sorted(docs, key=lambda doc: doc.id)]
+
+    ride_ids = ride_index.candidates(
+        (commute.startLocation.latitude, commute.startLocation.longitude),
+        (commute.endLocation.latitude, commute.endLocation.longitude),
+        settings.WALK_MAX_STRAIGHT_LINE_METERS
+    )
+    if not ride_ids:
+        return []
+
+    if ride_store is not None and ride_store.ready:
+        return [
+            dict(ride_data) for ride_id in sorted(ride_ids) if (ride_data := ride_store.get(ride_id)) is not None
+        ]
+
+    db = app.state.db
+    docs = [doc async for doc in db.get_all([rides_ref.document(ride_id) for ride_id in ride_ids])]
+    return [doc.to_dict() for doc in sorted((doc for doc in docs if doc.exists), key=lambda doc: doc.id)]
+
+def _index_commute(commute: Commute, app):
+    commute_index = app.state.commute_index
+    if commute_index is not None:
+        commute_index.add_commute(
+            commute.commuteId,
+            (commute.startLocation.latitude, commute.startLocation.longitude),
+            (commute.endLocation.latitude, commute.endLocation.longitude)
+        )
+
+async def refresh_commutes_for_ride(ride_id: str, ride_data: dict, previous_ride_data: dict | None, commutes_ref, app):
+    """Recompute a single ride's RideDistance on the commutes it can plausibly serve.
+
+    Meant to run in the background after a ride is created, updated or cancelled.
+    Commutes near the ride's previous route are included so a ride that moved away
+    is dropped from them; a cancelled ride is dropped everywhere it was near.
+    """
+    commute_index = app.state.commute_index
+    if commute_index is None:
+        return
+
+    radius = settings.WALK_MAX_STRAIGHT_LINE_METERS
+    commute_ids = commute_index.commutes_near_ride(ride_data, radius)
+    if previous_ride_data:
+        commute_ids |= commute_index.commutes_near_ride(previous_ride_data, radius)
+    logger.info(f"Refreshing ride {ride_id} on {len(commute_ids)} nearby commutes")
+
+    ride_distances_ref = app.state.ride_distances_ref
+    semaphore = asyncio.Semaphore(settings.COMMUTE_EVAL_CONCURRENCY)
+
+    async def refresh(commute_id):
+        async with semaphore:
+            try:
+                commute_ref = commutes_ref.document(commute_id)
+                commute_doc = await commute_ref.get()
+                if not commute_doc.exists:
+                    return
+                commute = Commute.model_validate(commute_doc.to_dict())
+
+                ride_distance = None
+                if ride_data.get("status", "active") != "cancelled":
+                    ride_distance = await evaluate_ride_for_commute(ride_data, commute, app)
+
+                if ride_distance:
+                    await upsert_ride_distance(commute_id, ride_distance, ride_distances_ref)
+                else:
+                    await delete_ride_distance(commute_id, ride_id, ride_distances_ref)
+            except Exception as e:
+                logger.error(f"Error refreshing ride {ride_id} on commute {commute_id}: {str(e)}")
+
+    await asyncio.gather(*[refresh(commute_id) for commute_id in commute_ids])
+
+async def recompute_ride_distances(commute: Commute, rides_ref, app, on_progress=None, before_store=None):
+    """Evaluate the candidate rides of a saved commute and store its ride distances.
+
+    on_progress(evaluated, total) is awaited once the candidates are known and
+    after each ride is evaluated. before_store() is awaited right before the
+    ride distances are written and can raise to keep them from being stored.
+    """
+    # Rows refreshed for a single ride after this point are newer than what is computed here
+    computed_since = datetime.now(timezone.utc)
+
+    # Get the rides that pass near the commute
+    logger.info(f"Fetching candidate rides for commute {commute.commuteId}")
+    all_rides = await fetch_candidate_rides(commute, rides_ref, app)
+    logger.info(f"Found {len(all_rides)} rides to evaluate")
+    if on_progress is not None:
+        await on_progress(0, len(all_rides))
+
+    ride_distances = await compute_ride_distances(commute, all_rides, app, on_progress)
+    logger.info(f"Found {len(ride_distances)} viable rides for commute {commute.commuteId}")
+
+    if before_store is not None:
+        await before_store()
+    await replace_ride_distances(
+        commute.commuteId, ride_distances, app.state.ride_distances_ref, app.state.db, computed_since
+    )
+    return ride_distances
+
+async def create_new_commute(commute: Commute, commutes_ref, app):
+    """Save a new commute and queue the job that computes its ride distances.
+
+    Returns the queued CommuteJob.
+    """
     try:
         logger.info(f"Creating new commute with ID: {commute.commuteId}")
-        
-        client = request.app.state.routes_client
+
         # Validate commute data
         if not commute.startLocation or not commute.endLocation:
             raise ValueError("Commute must have both start and end locations")
-            
+
         # Check if commute already exists
         commute_ref = commutes_ref.document(commute.commuteId)
-        existing = commute_ref.get()
-        
+        existing = await commute_ref.get()
+
         if existing.exists:
             raise ValueError(f"Commute with ID {commute.commuteId} already exists")
-        
-        # Get all rides
-        logger.info("Fetching all rides")
-        all_rides = list(rides_ref.stream())
-        logger.info(f"Found {len(all_rides)} rides to evaluate")
-        
-        # Create RideDistance objects for each ride
-        ride_distances = []
-        for index, ride_doc in enumerate(all_rides):
-            try:
-                ride_data = ride_doc.to_dict()
-                ride_id = ride_data.get("rideId")
-                
-                logger.info(f"Processing ride {index+1}/{len(all_rides)}: {ride_id}")
-                
-                # Validate ride data
-                if not ride_data.get('startLocation') or not ride_data.get('endLocation'):
-                    logger.warning(f"Skipping ride {ride_id}: Missing location data")
-                    continue
-                
-                # Extract coordinates
-                start_lat = ride_data.get('startLocation', {}).get('latitude')
-                start_lng = ride_data.get('startLocation', {}).get('longitude')
-                end_lat = ride_data.get('endLocation', {}).get('latitude')
-                end_lng = ride_data.get('endLocation', {}).get('longitude')
-                
-                # Validate coordinates
-                if None in [start_lat, start_lng, end_lat, end_lng]:
-                    logger.warning(f"Skipping ride {ride_id}: Invalid coordinates")
-                    continue
-                
-                logger.info(f"Finding closest points on route for ride {ride_id}")
-                
-                # Get ride polyline
-                encoded_polyline = ride_data.get('ridePolyline')
-                if not encoded_polyline:
-                    logger.warning(f"Ride {ride_id} has no polyline data")
-                
-                # Find closest points
-                try:
-                    result = await find_closest_points_on_route_by_walking(
-                        request=request,
-                        origin_A_coord=(start_lat, start_lng),
-                        destination_B_coord=(end_lat, end_lng),
-                        origin_X_coord=(commute.startLocation.latitude, commute.startLocation.longitude),
-                        destination_Y_coord=(commute.endLocation.latitude, commute.endLocation.longitude),
-                        encoded_polyline=encoded_polyline
-                    )
-                    
-                    if not result:
-                        logger.warning(f"Could not find route for ride {ride_id}")
-                        continue
-                        
-                    entry_point, exit_point, total_walk_distance, route_polyline = result
-                    
-                    # Validate results
-                    if not entry_point or not exit_point or total_walk_distance == float('inf'):
-                        logger.warning(f"Invalid route for ride {ride_id}")
-                        continue
-                    
-                    logger.info(f"Found viable route for ride {ride_id} with walking distance: {total_walk_distance}m")
-                    
-                    # Get walking polylines
-                    logger.info(f"Getting walking routes for ride {ride_id}")
-                    entry_polyline = await get_walking_route_polyline(client,
-                        (commute.startLocation.latitude, commute.startLocation.longitude), 
-                        entry_point
-                    )
-                    exit_polyline = await get_walking_route_polyline(client,
-                        exit_point,
-                        (commute.endLocation.latitude, commute.endLocation.longitude)
-                    )
-                    
-                    # Create ride distance object
-                    ride_distance = RideDistance(
-                        ride_id=ride_id,
-                        distance=total_walk_distance,
-                        entry_point=Location(latitude=entry_point[0], longitude=entry_point[1]),
-                        entry_polyline=entry_polyline,
-                        exit_point=Location(latitude=exit_point[0], longitude=exit_point[1]),
-                        exit_polyline=exit_polyline
-                    )
-                    ride_distances.append(ride_distance)
-                    logger.info(f"Added ride {ride_id} to viable options")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing ride {ride_id}: {str(e)}")
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"Error processing ride document: {str(e)}")
-                continue
-        
-        # Set the ride_distances field in the commute
-        logger.info(f"Found {len(ride_distances)} viable rides for commute")
-        commute.ride_distances = ride_distances
-        
-        # Save the commute to Firestore
+
+        # Save the commute to Firestore; ride distances live in their own collection
         logger.info(f"Saving commute {commute.commuteId} to Firestore")
-        commute_data = commute.model_dump()
-        commute_ref.set(commute_data)
-        
-        logger.info(f"Successfully created commute {commute.commuteId}")
-        return commute
-        
+        await commute_ref.set(commute.model_dump(exclude={"ride_distances"}))
+        _index_commute(commute, app)
+
+        job = await app.state.commute_jobs.submit(commute)
+        logger.info(f"Queued job {job.jobId} for commute {commute.commuteId}")
+        return job
+
     except Exception as e:
         logger.error(f"Failed to create commute: {str(e)}", exc_info=True)
         raise
 
-async def update_commute(commute_id: str, commute_update: Commute, commutes_ref, rides_ref, request):
-    """Update an existing commute in Firestore and recalculate ride distances"""
+async def update_commute(commute_id: str, commute_update: Commute, commutes_ref, app):
+    """Update an existing commute and queue the job that recalculates its ride distances.
+
+    Returns the queued CommuteJob.
+    """
     try:
         logger.info(f"Updating commute with ID: {commute_id}")
-        client = request.app.state.routes_client
         # Validate commute data
         if not commute_update.startLocation or not commute_update.endLocation:
             logger.error("Cannot update commute: Missing start or end location")
             raise ValueError("Commute must have both start and end locations")
-        
+
         # Check if commute exists
         logger.info(f"Checking if commute {commute_id} exists")
         commute_ref = commutes_ref.document(commute_id)
-        existing = commute_ref.get()
-        
+        existing = await commute_ref.get()
+
         if not existing.exists:
             logger.error(f"Commute {commute_id} not found")
             raise ValueError(f"Commute {commute_id} not found")
-        
+
         # Set updated timestamp
         commute_update.updatedAt = datetime.now()
         logger.info(f"Updating commute timestamp to {commute_update.updatedAt}")
-        
-        # Get all rides
-        logger.info("Fetching all rides to recalculate distances")
-        all_rides = list(rides_ref.stream())
-        logger.info(f"Found {len(all_rides)} rides to evaluate")
-        
-        # Create RideDistance objects for each ride
-        ride_distances = []
-        for index, ride_doc in enumerate(all_rides):
-            try:
-                ride_data = ride_doc.to_dict()
-                ride_id = ride_data.get("rideId")
-                
-                logger.info(f"Processing ride {index+1}/{len(all_rides)}: {ride_id}")
-                
-                # Validate ride data
-                if not ride_data.get('startLocation') or not ride_data.get('endLocation'):
-                    logger.warning(f"Skipping ride {ride_id}: Missing location data")
-                    continue
-                
-                # Extract coordinates
-                start_lat = ride_data.get('startLocation', {}).get('latitude')
-                start_lng = ride_data.get('startLocation', {}).get('longitude')
-                end_lat = ride_data.get('endLocation', {}).get('latitude')
-                end_lng = ride_data.get('endLocation', {}).get('longitude')
-                
-                # Validate coordinates
-                if None in [start_lat, start_lng, end_lat, end_lng]:
-                    logger.warning(f"Skipping ride {ride_id}: Invalid coordinates")
-                    continue
-                
-                # Get ride polyline
-                encoded_polyline = ride_data.get('ridePolyline')
-                if not encoded_polyline:
-                    logger.warning(f"Ride {ride_id} has no polyline data, may affect route calculation")
-                
-                logger.info(f"Finding closest points on route for ride {ride_id}")
-                
-                # Find closest points
-                try:
-                    result = await find_closest_points_on_route_by_walking(
-                        request=request,
-                        origin_A_coord=(start_lat, start_lng),
-                        destination_B_coord=(end_lat, end_lng),
-                        origin_X_coord=(commute_update.startLocation.latitude, commute_update.startLocation.longitude),
-                        destination_Y_coord=(commute_update.endLocation.latitude, commute_update.endLocation.longitude),
-                        encoded_polyline=encoded_polyline,
-                        sampling_distance_meters=100
-                    )
-                    
-                    if not result:
-                        logger.warning(f"Could not find route for ride {ride_id}")
-                        continue
-                    
-                    entry_point, exit_point, total_walk_distance, route_polyline = result
-                    
-                    # Validate results
-                    if not entry_point or not exit_point or total_walk_distance == float('inf'):
-                        logger.warning(f"Invalid route calculation for ride {ride_id}")
-                        continue
-                    
-                    logger.info(f"Found viable route for ride {ride_id} with walking distance: {total_walk_distance}m")
-                    
-                    # Generate walking polylines
-                    logger.info(f"Generating walking routes for ride {ride_id}")
-                    
-                    try:
-                        logger.info(f"Getting entry walking route for ride {ride_id}")
-                        entry_polyline = await get_walking_route_polyline(client,
-                            (commute_update.startLocation.latitude, commute_update.startLocation.longitude),
-                            entry_point
-                        )
-                        
-                        logger.info(f"Getting exit walking route for ride {ride_id}")
-                        exit_polyline = await get_walking_route_polyline(client,
-                            exit_point,
-                            (commute_update.endLocation.latitude, commute_update.endLocation.longitude)
-                        )
-                        
-                        # Create ride distance object
-                        ride_distance = RideDistance(
-                            ride_id=ride_id,
-                            distance=total_walk_distance,
-                            entry_point=Location(latitude=entry_point[0], longitude=entry_point[1]),
-                            entry_polyline=entry_polyline,
-                            exit_point=Location(latitude=exit_point[0], longitude=exit_point[1]),
-                            exit_polyline=exit_polyline
-                        )
-                        ride_distances.append(ride_distance)
-                        logger.info(f"Added ride {ride_id} to viable options")
-                        
-                    except Exception as e:
-                        logger.error(f"Error generating walking routes for ride {ride_id}: {str(e)}")
-                        continue
-                        
-                except Exception as e:
-                    logger.error(f"Error finding route points for ride {ride_id}: {str(e)}")
-                    continue
-                
-            except Exception as e:
-                logger.error(f"Error processing ride {ride_id}: {str(e)}")
-                continue
-        
-        # Set the updated ride_distances field in the commute
-        logger.info(f"Found {len(ride_distances)} viable rides for commute {commute_id}")
-        commute_update.ride_distances = ride_distances
-        
+
         # Update the commute
         try:
             logger.info(f"Saving updated commute {commute_id} to Firestore")
-            commute_data = commute_update.model_dump()
-            commute_ref.set(commute_data)
-            logger.info(f"Successfully updated commute {commute_id}")
-            return commute_update
+            await commute_ref.set(commute_update.model_dump(exclude={"ride_distances"}))
+            _index_commute(commute_update, app)
         except Exception as exc:
             logger.error(f"Error saving commute to Firestore: {str(exc)}")
             raise Exception(f"Error updating commute: {exc}")
-            
+
+        job = await app.state.commute_jobs.submit(commute_update)
+        logger.info(f"Queued job {job.jobId} for commute {commute_id}")
+        return job
+
     except Exception as e:
         logger.error(f"Failed to update commute {commute_id}: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
@@ -1,24 +1,79 @@
-import math
-import polyline
+import numpy as np
 
-def decode_polyline(encoded_polyline_str):
+EARTH_RADIUS_METERS = 6371000
+
+def decode_polyline_array(encoded_polyline_str, precision=5):
+    """Decode an encoded polyline into a contiguous (N, 2) float64 array of (lat, lng)"""
     if not encoded_polyline_str:
-        return []
-    return polyline.decode(encoded_polyline_str)
+        return np.empty((0, 2), dtype=np.float64)
 
-def haversine(coord1, coord2):
-    lat1, lon1 = coord1
-    lat2, lon2 = coord2
+    chars = np.frombuffer(encoded_polyline_str.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    # Every value is a run of 5-bit chunks; the last chunk of a run has the 0x20 bit clear
+    ends = np.flatnonzero((chars & 0x20) == 0)
+    if len(ends) < 2:
+        return np.empty((0, 2), dtype=np.float64)
+    ends = ends[:len(ends) - len(ends) % 2]
+    chars = chars[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
 
-    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    run_index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 5 * (np.arange(len(chars)) - starts[run_index])
+    values = np.add.reduceat((chars & 0x1f) << shifts, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    coords = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+    return np.ascontiguousarray(coords, dtype=np.float64)
+
+def haversine_pairwise(coords1, coords2):
+    """Great-circle distance in meters between matching rows of two (N, 2) arrays of (lat, lng)"""
+    coords1 = np.radians(np.asarray(coords1, dtype=np.float64).reshape(-1, 2))
+    coords2 = np.radians(np.asarray(coords2, dtype=np.float64).reshape(-1, 2))
+    lat1, lon1 = coords1[:, 0], coords1[:, 1]
+    lat2, lon2 = coords2[:, 0], coords2[:, 1]
 
     # Haversine formula
     dlon = lon2 - lon1
     dlat = lat2 - lat1
-    a = math.sin(dlat / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371000 # Radius of Earth in meters
-    return c * r
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def haversine_many(coords, coord):
+    """Great-circle distance in meters from every row of an (N, 2) array to one coord"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return haversine_pairwise(coords, np.broadcast_to(np.asarray(coord, dtype=np.float64), coords.shape))
+
+def sample_polyline_array(coords, sampling_distance_meters):
+    """Points every sampling_distance_meters along a path, plus its first and last point.
+
+    Returns (points, distances): an (M, 2) array of (lat, lng) and the distance in
+    meters of each point from the start, measured along the path.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) < 2:
+        return coords.copy(), np.zeros(len(coords))
+
+    along_path = np.concatenate(([0.0], np.cumsum(haversine_pairwise(coords[:-1], coords[1:]))))
+    total = along_path[-1]
+    targets = np.arange(1, int(total // sampling_distance_meters) + 1) * sampling_distance_meters
+
+    # Segment k holds the targets in (along_path[k], along_path[k+1]]; zero-length segments never match
+    segments = np.clip(np.searchsorted(along_path, targets, side='left') - 1, 0, len(coords) - 2)
+    segment_lengths = along_path[segments + 1] - along_path[segments]
+    fractions = (targets - along_path[segments]) / np.where(segment_lengths > 0, segment_lengths, 1.0)
+    samples = coords[segments] + (coords[segments + 1] - coords[segments]) * fractions[:, None]
+
+    points = np.vstack((coords[:1], samples))
+    distances = np.concatenate(([0.0], targets))
+    if haversine_pairwise(points[-1], coords[-1])[0] > 1e-6:
+        points = np.vstack((points, coords[-1:]))
+        distances = np.append(distances, total)
+    return points, distances
+
+def decode_polyline(encoded_polyline_str):
+    return [tuple(coord) for coord in decode_polyline_array(encoded_polyline_str).tolist()]
+
+def haversine(coord1, coord2):
+    return float(haversine_pairwise(coord1, coord2)[0])
 
 def interpolate(coord1, coord2, fraction):
     lat1, lon1 = coord1
@@ -28,31 +83,37 @@ def interpolate(coord1, coord2, fraction):
     return lat, lon
 
 def sample_points_along_polyline(decoded_coords, sampling_distance_meters):
-    if not decoded_coords or len(decoded_coords) < 2:
-        return decoded_coords[:] # Return a copy if too short to sample
-
-    sampled_points = [decoded_coords[0]]
-    distance_covered_on_segment = 0.0
-
-    for i in range(len(decoded_coords) - 1):
-        segment_start_coord = decoded_coords[i]
-        segment_end_coord = decoded_coords[i+1]
-        segment_length = haversine(segment_start_coord, segment_end_coord)
-        if segment_length <= 1e-9:
-            continue
-        distance_needed_from_segment_start = sampling_distance_meters - distance_covered_on_segment
-        current_pos_on_segment = 0.0
-        while distance_needed_from_segment_start <= (segment_length - current_pos_on_segment):
-            current_pos_on_segment += distance_needed_from_segment_start
-            fraction = current_pos_on_segment / segment_length
-            new_sample = interpolate(segment_start_coord, segment_end_coord, fraction)
-            if not sampled_points or haversine(new_sample, sampled_points[-1]) > 1e-6:
-                 sampled_points.append(new_sample)
-            distance_covered_on_segment = 0.0
-            distance_needed_from_segment_start = sampling_distance_meters
-        distance_covered_on_segment += (segment_length - current_pos_on_segment)
-
-    if not sampled_points or haversine(decoded_coords[-1], sampled_points[-1]) > 1e-6:
-         sampled_points.append(decoded_coords[-1])
-
-    return sampled_points
\ No newline at end of file
+    if decoded_coords is None:
+        return []
+    if len(decoded_coords) < 2:
+        return [tuple(coord) for coord in decoded_coords] # Return a copy if too short to sample
+    points, _ = sample_polyline_array(decoded_coords, sampling_distance_meters)
+    return [tuple(point) for point in points.tolist()]
+
+def nearest_candidates(coords, target_coord, max_candidates, max_distance_meters):
+    """Indices of the coords closest to target_coord in straight-line distance.
+
+    At most max_candidates indices are returned, all within max_distance_meters, sorted by index.
+    """
+    if len(coords) == 0:
+        return []
+    distances = haversine_many(coords, target_coord)
+    in_range = np.flatnonzero(distances <= max_distance_meters)
+    closest = in_range[np.argsort(distances[in_range], kind='stable')[:max_candidates]]
+    return sorted(closest.tolist())
+
+def best_entry_exit_pair(entry_distances, exit_distances):
+    """Pick entry index i <= exit index j minimising entry_distances[i] + exit_distances[j].
+
+    Single pass keeping the best entry seen so far, so the exit never comes before the entry.
+    Returns (i, j, total), or (None, None, inf) when no pair is reachable.
+    """
+    best_i, best_j, best_total = None, None, float('inf')
+    prefix_min, prefix_index = float('inf'), None
+    for j in range(min(len(entry_distances), len(exit_distances))):
+        if entry_distances[j] < prefix_min:
+            prefix_min, prefix_index = entry_distances[j], j
+        total = prefix_min + exit_distances[j]
+        if total < best_total:
+            best_i, best_j, best_total = prefix_index, j, total
+    return best_i, best_j, best_total
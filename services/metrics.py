@@ -0,0 +1,11 @@
+from collections import Counter
+
+# Process-wide counters, exposed by the /metrics endpoint
+_counters = Counter()
+
+def increment(name, amount=1):
+    _counters[name] += amount
+
+def snapshot():
+    """Current value of every counter, by name"""
+    return dict(sorted(_counters.items()))
@@ -1,18 +1,15 @@
-from models import RideRequest, RideRequestStatus, RiderDetail
+from models import RideRequest, RideRequestStatus, RiderDetail, RequestDecisionResult
 from datetime import datetime
+from .serialization import RIDE_REQUEST_LIST_ADAPTER
+from .ride_service import RIDER_IDS_FIELD, rider_ids
+from .transactions import run_transaction, TransactionContentionError
+from google.cloud.firestore_v1.field_path import FieldPath
 
 async def get_ride_requests_by_rider(rider_id: str, requests_ref):
     """Get all ride requests created by a specific rider"""
     try:
         requests_query = requests_ref.where("riderId", "==", rider_id).stream()
-        requests = []
-        
-        for doc in requests_query:
-            request_data = doc.to_dict()
-            request_model = RideRequest.model_validate(request_data)
-            requests.append(request_model)
-        
-        return requests
+        return RIDE_REQUEST_LIST_ADAPTER.validate_python([doc.to_dict() async for doc in requests_query])
     except Exception as exc:
         raise Exception(f"Error retrieving ride requests: {exc}")
 
@@ -20,21 +17,19 @@ async def get_ride_requests_by_driver(driver_id: str, requests_ref):
     """Get all ride requests for rides created by a specific driver"""
     try:
         requests_query = requests_ref.where("driverId", "==", driver_id).stream()
-        requests = []
-        
-        for doc in requests_query:
-            request_data = doc.to_dict()
-            request_model = RideRequest.model_validate(request_data)
-            requests.append(request_model)
-        
-        return requests
+        return RIDE_REQUEST_LIST_ADAPTER.validate_python([doc.to_dict() async for doc in requests_query])
     except Exception as exc:
         raise Exception(f"Error retrieving ride requests: {exc}")
 
+async def stream_ride_requests_by_driver(driver_id: str, requests_ref):
+    """Yield the ride requests for a driver's rides as they are read"""
+    async for doc in requests_ref.where("driverId", "==", driver_id).stream():
+        yield RideRequest.model_validate(doc.to_dict())
+
 async def get_ride_request_by_id(request_id: str, requests_ref):
     """Get a specific ride request by ID"""
     try:
-        request_doc = requests_ref.document(request_id).get()
+        request_doc = await requests_ref.document(request_id).get()
         if not request_doc.exists:
             return None
         
@@ -46,7 +41,7 @@ async def get_ride_request_by_id(request_id: str, requests_ref):
 async def create_ride_request(request: RideRequest, rides_ref, requests_ref):
     """Create a new ride request"""
     # Check if ride exists and has available seats
-    ride_doc = rides_ref.document(request.rideId).get()
+    ride_doc = await rides_ref.document(request.rideId).get()
     if not ride_doc.exists:
         raise ValueError(f"Ride {request.rideId} not found")
     
@@ -61,7 +56,7 @@ async def create_ride_request(request: RideRequest, rides_ref, requests_ref):
     existing_requests = requests_ref.where("riderId", "==", request.riderId).where(
         "status", "==", RideRequestStatus.PENDING).stream()
     
-    for _ in existing_requests:
+    async for _ in existing_requests:
         raise ValueError("You already have a pending ride request")
     
     # Create the request
@@ -69,43 +64,65 @@ async def create_ride_request(request: RideRequest, rides_ref, requests_ref):
     request_ref = requests_ref.document(request.requestId)
     
     try:
-        request_ref.set(request_data)
+        await request_ref.set(request_data)
         return request
     except Exception as exc:
         raise Exception(f"Error creating ride request: {exc}")
 
-async def handle_ride_request(request_id: str, driver_id: str, status: RideRequestStatus, rides_ref, requests_ref):
-    """Approve or reject a ride request"""
-    # Get the request
-    request_doc = requests_ref.document(request_id).get()
-    if not request_doc.exists:
-        raise ValueError(f"Request {request_id} not found")
-    
-    request_data = request_doc.to_dict()
-    
-    # Verify driver owns the ride
-    if request_data["driverId"] != driver_id:
-        raise ValueError("You don't have permission to handle this request")
-    
-    # Get the ride
-    ride_doc = rides_ref.document(request_data["rideId"]).get()
-    if not ride_doc.exists:
-        raise ValueError(f"Ride {request_data['rideId']} not found")
-    
-    ride_data = ride_doc.to_dict()
-    
-    # If approving, check available seats
-    if status == RideRequestStatus.APPROVED and ride_data["availableSeats"] <= 0:
-        raise ValueError("No available seats left on this ride")
-    
-    # Update request status
-    try:
-        requests_ref.document(request_id).update({
+def _approval_failure(rider_id: str, riders, available_seats: int):
+    """Why a rider can't be approved onto a ride, or None when they can"""
+    if rider_id in riders:
+        return f"Rider {rider_id} is already on this ride"
+    if available_seats <= 0:
+        return "No available seats left on this ride"
+    return None
+
+async def handle_ride_request(request_id: str, driver_id: str, status: RideRequestStatus, rides_ref, requests_ref, db):
+    """Approve or reject a ride request.
+
+    Runs as a transaction over the request and its ride, so concurrent approvals
+    can't oversell seats. Only the approved rider's entry of the riders map is
+    written, leaving other riders untouched.
+    """
+    request_ref = requests_ref.document(request_id)
+
+    async def apply(transaction):
+        # Get the request
+        request_doc = await request_ref.get(transaction=transaction)
+        if not request_doc.exists:
+            raise ValueError(f"Request {request_id} not found")
+        
+        request_data = request_doc.to_dict()
+        
+        # Verify driver owns the ride
+        if request_data["driverId"] != driver_id:
+            raise ValueError("You don't have permission to handle this request")
+
+        if request_data["status"] != RideRequestStatus.PENDING:
+            raise ValueError(f"Request {request_id} is already {request_data['status']}")
+        
+        # Get the ride
+        ride_ref = rides_ref.document(request_data["rideId"])
+        ride_doc = await ride_ref.get(transaction=transaction)
+        if not ride_doc.exists:
+            raise ValueError(f"Ride {request_data['rideId']} not found")
+        
+        ride_data = ride_doc.to_dict()
+        
+        # If approving, check the rider isn't on the ride yet and a seat is left
+        if status == RideRequestStatus.APPROVED:
+            failure = _approval_failure(request_data["riderId"], ride_data.get("riders") or {}, ride_data["availableSeats"])
+            if failure:
+                raise ValueError(failure)
+
+        # Update request status
+        now = datetime.now()
+        transaction.update(request_ref, {
             "status": status,
-            "updatedAt": datetime.now()
+            "updatedAt": now
         })
         
-        # If approved, update the ride
+        # If approved, add the rider to the ride and decrement available seats
         if status == RideRequestStatus.APPROVED:
             rider_id = request_data["riderId"]
             rider_detail = RiderDetail(
@@ -114,17 +131,102 @@ async def handle_ride_request(request_id: str, driver_id: str, status: RideReque
                 rideStatus=RideRequestStatus.APPROVED,
                 requestId=request_id
             )
-            
-            # Update ride with rider information and decrement available seats
-            if not ride_data.get("riders"):
-                ride_data["riders"] = {}
-                
-            ride_data["riders"][rider_id] = rider_detail.model_dump()
-            ride_data["availableSeats"] -= 1
-            ride_data["updatedAt"] = datetime.now()
-            
-            rides_ref.document(request_data["rideId"]).set(ride_data)
-            
+            transaction.update(ride_ref, {
+                FieldPath("riders", rider_id).to_api_repr(): rider_detail.model_dump(),
+                RIDER_IDS_FIELD: rider_ids({**(ride_data.get("riders") or {}), rider_id: None}),
+                "availableSeats": ride_data["availableSeats"] - 1,
+                "updatedAt": now
+            })
+
+    try:
+        await run_transaction(db, apply, "handle_ride_request")
         return {"status": "success", "message": f"Request {status}"}
+    except (ValueError, TransactionContentionError):
+        raise
+    except Exception as exc:
+        raise Exception(f"Error handling ride request: {exc}")
+
+async def handle_ride_requests_bulk(ride_id: str, driver_id: str, decisions, rides_ref, requests_ref, db):
+    """Approve or reject several requests for one ride in a single transaction.
+
+    The ride and every request are read in one get_all round trip. Approvals are
+    granted in the given order while seats last. Requests that can't be decided
+    get a failed RequestDecisionResult, and all the others are written together.
+    """
+    ride_ref = rides_ref.document(ride_id)
+    request_refs = {decision.requestId: requests_ref.document(decision.requestId) for decision in decisions}
+
+    async def apply(transaction):
+        snapshots = {
+            doc.reference.path: doc
+            async for doc in db.get_all([ride_ref, *request_refs.values()], transaction=transaction)
+        }
+        ride_doc = snapshots.get(ride_ref.path)
+        if ride_doc is None or not ride_doc.exists:
+            raise ValueError(f"Ride {ride_id} not found")
+
+        ride_data = ride_doc.to_dict()
+        if ride_data["driverId"] != driver_id:
+            raise ValueError("You don't have permission to handle requests for this ride")
+
+        available_seats = ride_data["availableSeats"]
+        riders = ride_data.get("riders") or {}
+        approved = {}
+        now = datetime.now()
+        results = []
+        seen = set()
+
+        for decision in decisions:
+            request_id = decision.requestId
+            request_doc = snapshots.get(request_refs[request_id].path)
+            failure = None
+            if request_id in seen:
+                failure = "Duplicate request in this batch"
+            elif request_doc is None or not request_doc.exists:
+                failure = f"Request {request_id} not found"
+            else:
+                request_data = request_doc.to_dict()
+                if request_data["rideId"] != ride_id:
+                    failure = f"Request {request_id} is not for ride {ride_id}"
+                elif request_data["status"] != RideRequestStatus.PENDING:
+                    failure = f"Request {request_id} is already {request_data['status']}"
+                elif decision.status == RideRequestStatus.APPROVED:
+                    failure = _approval_failure(request_data["riderId"], riders.keys() | approved.keys(), available_seats)
+            seen.add(request_id)
+
+            if failure:
+                results.append(RequestDecisionResult(requestId=request_id, success=False, message=failure))
+                continue
+
+            transaction.update(request_refs[request_id], {
+                "status": decision.status,
+                "updatedAt": now
+            })
+            if decision.status == RideRequestStatus.APPROVED:
+                available_seats -= 1
+                approved[request_data["riderId"]] = RiderDetail(
+                    pickupLocation=request_data["pickupLocation"],
+                    dropoffLocation=request_data["dropoffLocation"],
+                    rideStatus=RideRequestStatus.APPROVED,
+                    requestId=request_id
+                ).model_dump()
+            results.append(RequestDecisionResult(
+                requestId=request_id, status=decision.status, success=True, message=f"Request {decision.status.value}"
+            ))
+
+        # Only the newly approved riders' entries of the riders map are written
+        if approved:
+            transaction.update(ride_ref, {
+                **{FieldPath("riders", rider_id).to_api_repr(): details for rider_id, details in approved.items()},
+                RIDER_IDS_FIELD: rider_ids({**riders, **approved}),
+                "availableSeats": available_seats,
+                "updatedAt": now
+            })
+        return results
+
+    try:
+        return await run_transaction(db, apply, "handle_ride_requests_bulk")
+    except (ValueError, TransactionContentionError):
+        raise
     except Exception as exc:
-        raise Exception(f"Error handling ride request: {exc}")
\ No newline at end of file
+        raise Exception(f"Error handling ride requests: {exc}")
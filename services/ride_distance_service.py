@@ -0,0 +1,77 @@
+from datetime import datetime, timezone
+from models import RideDistance
+from .batching import commit_in_batches
+from .schedule import as_utc
+
+POLYLINE_FIELDS = ["entry_polyline", "exit_polyline"]
+SUMMARY_FIELDS = [field for field in RideDistance.model_fields if field not in POLYLINE_FIELDS]
+
+def ride_distance_doc_id(commute_id: str, ride_id: str):
+    return f"{commute_id}__{ride_id}"
+
+def ride_distance_data(commute_id: str, ride_distance: RideDistance):
+    return {**ride_distance.model_dump(), "commuteId": commute_id, "updatedAt": datetime.now(timezone.utc)}
+
+async def replace_ride_distances(commute_id: str, ride_distances, ride_distances_ref, db, computed_since=None):
+    """Make the stored ride distances of a commute exactly ride_distances, using batched writes.
+
+    Rows written after computed_since, when the ride distances started being
+    computed, come from incremental ride refreshes that are newer than
+    ride_distances, so they are neither deleted nor overwritten.
+    """
+    existing = {
+        doc.id: doc.to_dict().get("updatedAt")
+        async for doc in ride_distances_ref.where("commuteId", "==", commute_id).select(["updatedAt"]).stream()
+    }
+    newer_ids = {
+        doc_id for doc_id, updated_at in existing.items()
+        if computed_since is not None and updated_at is not None and as_utc(updated_at) > computed_since
+    }
+    new_ids = {ride_distance_doc_id(commute_id, rd.ride_id) for rd in ride_distances}
+
+    writes = [
+        ("delete", ride_distances_ref.document(doc_id), None)
+        for doc_id in existing if doc_id not in new_ids and doc_id not in newer_ids
+    ] + [
+        ("set", ride_distances_ref.document(doc_id), ride_distance_data(commute_id, rd))
+        for rd in ride_distances if (doc_id := ride_distance_doc_id(commute_id, rd.ride_id)) not in newer_ids
+    ]
+    await commit_in_batches(writes, db)
+
+async def upsert_ride_distance(commute_id: str, ride_distance: RideDistance, ride_distances_ref):
+    await ride_distances_ref.document(ride_distance_doc_id(commute_id, ride_distance.ride_id)).set(
+        ride_distance_data(commute_id, ride_distance)
+    )
+
+async def delete_ride_distance(commute_id: str, ride_id: str, ride_distances_ref):
+    await ride_distances_ref.document(ride_distance_doc_id(commute_id, ride_id)).delete()
+
+async def get_ride_distances(commute_id: str, ride_distances_ref, max_distance_meters: float | None = None,
+                             include_polylines: bool = False):
+    """Stored ride distances of a commute, closest first.
+
+    Rows farther than max_distance_meters are filtered out by Firestore, and the
+    walking polylines are only transferred when include_polylines is set.
+    """
+    query = ride_distances_ref.where("commuteId", "==", commute_id)
+    if max_distance_meters is not None:
+        query = query.where("distance", "<=", max_distance_meters)
+    query = query.order_by("distance")
+    if not include_polylines:
+        query = query.select(SUMMARY_FIELDS)
+
+    return [RideDistance.model_validate(doc.to_dict()) async for doc in query.stream()]
+
+async def get_ride_distance_polylines(commute_id: str, ride_ids, ride_distances_ref, db):
+    """Walking polylines of some of a commute's ride distances, as {ride_id: (entry_polyline, exit_polyline)}.
+
+    Only the polyline fields of the requested rows are read, in one get_all round trip.
+    """
+    docs = db.get_all(
+        [ride_distances_ref.document(ride_distance_doc_id(commute_id, ride_id)) for ride_id in ride_ids],
+        field_paths=["ride_id", *POLYLINE_FIELDS]
+    )
+    return {
+        data["ride_id"]: (data.get("entry_polyline"), data.get("exit_polyline"))
+        async for doc in docs if doc.exists and (data := doc.to_dict()).get("ride_id")
+    }
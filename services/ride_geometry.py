@@ -0,0 +1,56 @@
+import zlib
+import numpy as np
+from .helpers import decode_polyline_array, sample_polyline_array
+
+# Ride document field holding the pre-sampled route geometry
+GEOMETRY_FIELD = "routeGeometry"
+GEOMETRY_SAMPLING_METERS = 100
+
+def _checksum(encoded_polyline):
+    return zlib.crc32(encoded_polyline.encode("ascii"))
+
+def build_ride_geometry(encoded_polyline, sampling_distance_meters=GEOMETRY_SAMPLING_METERS):
+    """Pre-sampled geometry of a ride polyline, stored on the ride document at write time.
+
+    Points and cumulative distances along the route are packed as little-endian
+    float32 blobs; the polyline checksum lets readers detect a stale geometry.
+    Returns None when there is no polyline to sample.
+    """
+    if not encoded_polyline:
+        return None
+    points, distances = sample_polyline_array(decode_polyline_array(encoded_polyline), sampling_distance_meters)
+    if len(points) == 0:
+        return None
+
+    min_lat, min_lng = points.min(axis=0).tolist()
+    max_lat, max_lng = points.max(axis=0).tolist()
+    return {
+        "points": points.astype("<f4").tobytes(),
+        "distances": distances.astype("<f4").tobytes(),
+        "bbox": [min_lat, min_lng, max_lat, max_lng],
+        "samplingMeters": sampling_distance_meters,
+        "polylineChecksum": _checksum(encoded_polyline),
+    }
+
+def load_ride_geometry(ride_data, sampling_distance_meters=GEOMETRY_SAMPLING_METERS):
+    """Sampled (points, distances) arrays of a ride's route.
+
+    Uses the stored geometry when it matches the ride's polyline and sampling
+    distance, otherwise decodes and samples the polyline. Both arrays are empty
+    when the ride has no polyline.
+    """
+    encoded_polyline = ride_data.get("ridePolyline")
+    if not encoded_polyline:
+        return np.empty((0, 2), dtype=np.float64), np.empty(0, dtype=np.float64)
+
+    geometry = ride_data.get(GEOMETRY_FIELD)
+    if (
+        geometry
+        and geometry.get("samplingMeters") == sampling_distance_meters
+        and geometry.get("polylineChecksum") == _checksum(encoded_polyline)
+    ):
+        points = np.frombuffer(geometry["points"], dtype="<f4").astype(np.float64).reshape(-1, 2)
+        distances = np.frombuffer(geometry["distances"], dtype="<f4").astype(np.float64)
+        return points, distances
+
+    return sample_polyline_array(decode_polyline_array(encoded_polyline), sampling_distance_meters)
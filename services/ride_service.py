@@ -1,48 +1,111 @@
 from models import Ride, RideRequestStatus
-from datetime import datetime
-from uuid import uuid4
+from datetime import datetime, timezone
 from .utils import get_driving_route_polyline
+from .commute_service import refresh_commutes_for_ride
+from .ride_distance_service import get_ride_distances, get_ride_distance_polylines
+from .batching import commit_in_batches
+from .ride_geometry import GEOMETRY_FIELD, build_ride_geometry
 from google.maps import routing_v2
+from google.cloud.firestore_v1.field_path import FieldPath
+from bisect import bisect_right
+from pydantic import ValidationError
+from .serialization import RIDE_LIST_ADAPTER
+from .schedule import schedule_compatible, as_utc
 
-async def get_all_rides(rides_ref):
-    """Get all rides from Firestore with validation error handling"""
-    rides = []    
-    for doc in rides_ref.stream():
-        try:
-            ride_data = doc.to_dict()
-            
-            if 'availableSeats' in ride_data and 'totalSeats' not in ride_data:
-                ride_data['totalSeats'] = ride_data['availableSeats']
-            
-            if 'riders' in ride_data and ride_data['riders']:
-                for rider_id, rider_details in ride_data['riders'].items():
-                    # Convert 'reserved' to 'approved'
-                    if rider_details.get('rideStatus') == 'reserved':
-                        ride_data['riders'][rider_id]['rideStatus'] = 'approved'
-                    
-                    if 'requestId' not in rider_details:
-                        ride_data['riders'][rider_id]['requestId'] = f"req_{uuid4().hex}"
-            
-            ride_model = Ride.model_validate(ride_data)
-            rides.append(ride_model.model_dump())
-        except Exception as exc:
-            print(f"Error parsing ride document {doc.id}: {exc}")
-    
-    return rides
+# Ride document field listing the keys of riders, so a rider's rides can be queried
+RIDER_IDS_FIELD = "riderIds"
 
-async def get_ride_by_id(ride_id: str, rides_ref):
-    """Get a ride by its ID"""
-    ride_doc = rides_ref.document(ride_id).get()
-    if not ride_doc.exists:
+def rider_ids(riders):
+    return sorted(riders or {})
+
+async def get_all_rides(rides_ref, ride_store=None):
+    """Get all rides as Ride models, from the ride store when it is loaded"""
+    if ride_store is not None and ride_store.ready:
+        return _validate_rides(ride_store.items())
+    return _validate_rides([(doc.id, doc.to_dict()) async for doc in rides_ref.stream()])
+
+async def get_rides_page(rides_ref, limit: int, page_token: str | None = None, fields: list[str] | None = None,
+                         ride_store=None):
+    """One page of rides ordered by rideId, and the token of the next page (None on the last page).
+
+    page_token is the rideId the previous page ended on. With fields, only those
+    fields (plus rideId) are read and the rides are returned unvalidated.
+    """
+    if fields is not None:
+        fields = sorted(set(fields) | {"rideId"})
+
+    if ride_store is not None and ride_store.ready:
+        items = ride_store.items()
+        start = bisect_right([ride_id for ride_id, _ in items], page_token) if page_token else 0
+        documents = items[start:start + limit]
+        if fields is not None:
+            documents = [(ride_id, {field: data[field] for field in fields if field in data}) for ride_id, data in documents]
+    else:
+        query = rides_ref.order_by(FieldPath.document_id())
+        if page_token:
+            query = query.start_after({FieldPath.document_id(): page_token})
+        if fields is not None:
+            query = query.select(fields)
+        documents = [(doc.id, doc.to_dict()) async for doc in query.limit(limit).stream()]
+
+    next_page_token = documents[-1][0] if len(documents) == limit else None
+    if fields is not None:
+        return [dict(data) for _, data in documents], next_page_token
+    return _validate_rides(documents), next_page_token
+
+def _validate_rides(documents):
+    """Validate (rideId, data) pairs into Rides, skipping documents that don't parse.
+
+    The whole list goes through the cached list adapter in one call; only when
+    some document is invalid are they validated one by one to drop the bad ones.
+    """
+    documents = list(documents)
+    try:
+        return RIDE_LIST_ADAPTER.validate_python([document for _, document in documents])
+    except ValidationError:
+        rides = [_validate_ride(ride_id, document) for ride_id, document in documents]
+        return [ride for ride in rides if ride is not None]
+
+def _validate_ride(ride_id, document):
+    """Validate one ride document into a Ride, or None if it doesn't parse"""
+    try:
+        return Ride.model_validate(document)
+    except Exception as exc:
+        print(f"Error parsing ride document {ride_id}: {exc}")
         return None
+
+async def stream_all_rides(rides_ref, ride_store=None):
+    """Yield every ride as a Ride as soon as its document is read"""
+    if ride_store is not None and ride_store.ready:
+        for ride_id, document in ride_store.items():
+            ride = _validate_ride(ride_id, document)
+            if ride is not None:
+                yield ride
+        return
+
+    async for doc in rides_ref.stream():
+        ride = _validate_ride(doc.id, doc.to_dict())
+        if ride is not None:
+            yield ride
+
+async def get_ride_by_id(ride_id: str, rides_ref, ride_store=None):
+    """Get a ride by its ID"""
+    if ride_store is not None and ride_store.ready:
+        ride_data = ride_store.get(ride_id)
+        if ride_data is None:
+            return None
+    else:
+        ride_doc = await rides_ref.document(ride_id).get()
+        if not ride_doc.exists:
+            return None
+        ride_data = ride_doc.to_dict()
     
     try:
-        ride_data = ride_doc.to_dict()
         return Ride.model_validate(ride_data)
     except Exception as exc:
         raise Exception(f"Error parsing ride document: {exc}")
 
-async def create_new_ride(ride: Ride, rides_ref, request):
+async def create_new_ride(ride: Ride, rides_ref, request, background_tasks):
     client = request.app.state.routes_client
     """Create a new ride in Firestore"""
     ride_data = ride.model_dump()
@@ -51,7 +114,7 @@ async def create_new_ride(ride: Ride, rides_ref, request):
     
     # Check if ride already exists
     ride_ref = rides_ref.document(ride.rideId)
-    existing = ride_ref.get()
+    existing = await ride_ref.get()
     
     if existing.exists:
         raise ValueError("Ride already exists")
@@ -63,13 +126,14 @@ async def create_new_ride(ride: Ride, rides_ref, request):
     # Initialize empty riders dictionary if not provided
     if ride_data.get("riders") is None:
         ride_data["riders"] = {}
+    ride_data[RIDER_IDS_FIELD] = rider_ids(ride_data["riders"])
 
     if not ride_data.get("ridePolyline"):
         start_coords = [ride.startLocation.latitude, ride.startLocation.longitude]
         end_coords = [ride.endLocation.latitude, ride.endLocation.longitude]
         
         try: 
-            polyline = await get_driving_route_polyline(client, start_coords, end_coords)
+            polyline = await get_driving_route_polyline(client, start_coords, end_coords, request.app.state.route_cache)
             if polyline:
                 ride_data["ridePolyline"] = polyline
                 print(f"Route polyline generated for ride {ride.rideId}")
@@ -77,18 +141,26 @@ async def create_new_ride(ride: Ride, rides_ref, request):
                 print(f"Warning: Could not generate polyline for ride {ride.rideId}")
         except Exception as exc:
             print(f"Error generating polyline for ride {ride.rideId}: {exc}")
+
+    # Store the sampled route so commute matching never has to decode it
+    ride_data[GEOMETRY_FIELD] = build_ride_geometry(ride_data.get("ridePolyline"))
     
     # Create new ride document
     try:
-        ride_ref.set(ride_data)
+        await ride_ref.set(ride_data)
+        if request.app.state.ride_index is not None:
+            request.app.state.ride_index.add_ride(ride.rideId, ride_data)
+        background_tasks.add_task(
+            refresh_commutes_for_ride, ride.rideId, ride_data, None, request.app.state.commutes_ref, request.app
+        )
         return ride
     except Exception as exc:
         raise Exception(f"Error creating ride document: {exc}")
 
-async def update_ride(ride_id: str, updates: dict, rides_ref, request):
+async def update_ride(ride_id: str, updates: dict, rides_ref, request, background_tasks):
     """Update a ride in Firestore"""
     ride_ref = rides_ref.document(ride_id)
-    ride_doc = ride_ref.get()
+    ride_doc = await ride_ref.get()
     
     
     if not ride_doc.exists:
@@ -99,24 +171,68 @@ async def update_ride(ride_id: str, updates: dict, rides_ref, request):
     
     client = request.app.state.routes_client
     try:
-        polyline = await get_driving_route_polyline(client, start_coords, end_coords)
+        polyline = await get_driving_route_polyline(client, start_coords, end_coords, request.app.state.route_cache)
         if polyline:
             updates["ridePolyline"] = polyline
     except Exception:
         print(f"Warning: Could not generate polyline for ride {ride_id}")
+    if "riders" in updates:
+        updates[RIDER_IDS_FIELD] = rider_ids(updates["riders"])
+    updates[GEOMETRY_FIELD] = build_ride_geometry(updates.get("ridePolyline", ride_data.get("ridePolyline")))
     updates["updatedAt"] = datetime.now()
     
     try:
-        ride_ref.update(updates)
-        updated_doc = ride_ref.get()
-        return Ride.model_validate(updated_doc.to_dict())
+        await ride_ref.update(updates)
+        updated_doc = await ride_ref.get()
+        updated_data = updated_doc.to_dict()
+        if request.app.state.ride_index is not None:
+            request.app.state.ride_index.add_ride(ride_id, updated_data)
+        background_tasks.add_task(
+            refresh_commutes_for_ride, ride_id, updated_data, ride_data, request.app.state.commutes_ref, request.app
+        )
+        return Ride.model_validate(updated_data)
     except Exception as exc:
         raise Exception(f"Error updating ride: {exc}")
 
-async def cancel_ride(ride_id: str, driver_id: str, rides_ref, requests_ref):
-    """Cancel a ride and update all associated requests"""
+async def _cancel_ride_operations(ride_id: str, ride_data: dict, rides_ref, requests_ref, now):
+    """Writes that cancel a ride: its pending and approved requests first, the ride itself last.
+
+    Approved riders are marked cancelled in the ride's riders map as well, so they
+    see the cancellation on their rides. When the writes span several batches, a
+    ride only shows as cancelled once all its requests are, so cancelling again
+    finishes an interrupted run.
+    """
+    open_requests = requests_ref.where("rideId", "==", ride_id).where(
+        "status", "in", [RideRequestStatus.PENDING, RideRequestStatus.APPROVED]).stream()
+    operations = [
+        ("update", req_doc.reference, {"status": RideRequestStatus.CANCELLED, "updatedAt": now})
+        async for req_doc in open_requests
+    ]
+
+    riders = ride_data.get("riders") or {}
+    ride_updates = {
+        "status": "cancelled",
+        RIDER_IDS_FIELD: rider_ids(riders),
+        "updatedAt": now
+    }
+    for rider_id, rider_details in riders.items():
+        if rider_details.get("rideStatus") == RideRequestStatus.APPROVED:
+            ride_updates[FieldPath("riders", rider_id, "rideStatus").to_api_repr()] = RideRequestStatus.CANCELLED
+    operations.append(("update", rides_ref.document(ride_id), ride_updates))
+    return operations
+
+def _after_ride_cancelled(ride_id: str, ride_data: dict, request, background_tasks):
+    if request.app.state.ride_index is not None:
+        request.app.state.ride_index.remove_ride(ride_id)
+    background_tasks.add_task(
+        refresh_commutes_for_ride, ride_id, {**ride_data, "status": "cancelled"}, None,
+        request.app.state.commutes_ref, request.app
+    )
+
+async def cancel_ride(ride_id: str, driver_id: str, rides_ref, requests_ref, request, background_tasks):
+    """Cancel a ride and all its pending and approved requests"""
     # Verify ride exists and belongs to driver
-    ride_doc = rides_ref.document(ride_id).get()
+    ride_doc = await rides_ref.document(ride_id).get()
     if not ride_doc.exists:
         raise ValueError(f"Ride {ride_id} not found")
     
@@ -124,78 +240,115 @@ async def cancel_ride(ride_id: str, driver_id: str, rides_ref, requests_ref):
     if ride_data["driverId"] != driver_id:
         raise ValueError("You don't have permission to cancel this ride")
     
-    # Update ride status to cancelled
+    # Cancel the ride and its requests together in write batches
     try:
-        rides_ref.document(ride_id).update({
-            "status": "cancelled",
-            "updatedAt": datetime.now()
-        })
-        
-        # Update all pending requests for this ride to cancelled
-        pending_requests = requests_ref.where("rideId", "==", ride_id).where(
-            "status", "==", RideRequestStatus.PENDING).stream()
-        
-        for req_doc in pending_requests:
-            req_doc.reference.update({
-                "status": RideRequestStatus.CANCELLED,
-                "updatedAt": datetime.now()
-            })
-            
+        operations = await _cancel_ride_operations(ride_id, ride_data, rides_ref, requests_ref, datetime.now())
+        await commit_in_batches(operations, request.app.state.db)
+        _after_ride_cancelled(ride_id, ride_data, request, background_tasks)
         return {"status": "success", "message": "Ride cancelled successfully"}
     except Exception as exc:
         raise Exception(f"Error cancelling ride: {exc}")
 
-async def get_rides_by_driver(driver_id: str, rides_ref):
-    """Get all rides for a specific driver"""
+async def cancel_future_rides(driver_id: str, rides_ref, requests_ref, request, background_tasks):
+    """Cancel every active ride of a driver that still has trips ahead, with their requests.
+
+    That is every ride that hasn't started yet, and every recurring ride (one
+    with daysOfWeek), since those keep running after their first startTime.
+    """
     try:
-        rides_query = rides_ref.where("driverId", "==", driver_id).stream()
-        rides = []
-        
-        for doc in rides_query:
-            ride_data = doc.to_dict()
-            ride = Ride.model_validate(ride_data)
-            rides.append(ride.model_dump())
-            
-        return rides
+        # Start times are filtered here so the query needs no composite index
+        active_rides = rides_ref.where("driverId", "==", driver_id).where("status", "==", "active").stream()
+        now = datetime.now(timezone.utc)
+        future_rides = [
+            (doc.id, ride_data) async for doc in active_rides
+            if (ride_data := doc.to_dict()).get("daysOfWeek") or as_utc(ride_data["startTime"]) > now
+        ]
+
+        operations = []
+        for ride_id, ride_data in future_rides:
+            operations += await _cancel_ride_operations(ride_id, ride_data, rides_ref, requests_ref, datetime.now())
+        await commit_in_batches(operations, request.app.state.db)
+
+        for ride_id, ride_data in future_rides:
+            _after_ride_cancelled(ride_id, ride_data, request, background_tasks)
+        return {
+            "status": "success",
+            "message": f"Cancelled {len(future_rides)} future rides",
+            "cancelled_rides": [ride_id for ride_id, _ in future_rides],
+            "cancelled_requests": len(operations) - len(future_rides)
+        }
+    except Exception as exc:
+        raise Exception(f"Error cancelling future rides: {exc}")
+
+async def get_rides_by_driver(driver_id: str, rides_ref, ride_store=None):
+    """Get all rides for a specific driver as Ride models"""
+    try:
+        if ride_store is not None and ride_store.ready:
+            documents = ride_store.by_driver(driver_id)
+        else:
+            documents = [doc.to_dict() async for doc in rides_ref.where("driverId", "==", driver_id).stream()]
+        return RIDE_LIST_ADAPTER.validate_python(documents)
     except Exception as exc:
         raise Exception(f"Error retrieving driver rides: {exc}")
 
-async def get_rides_for_rider(rider_id: str, rides_ref):
-    """Get all rides that a rider is part of"""
+async def get_rides_for_rider(rider_id: str, rides_ref, ride_store=None):
+    """Get all rides that a rider is part of as Ride models"""
     try:
-        # Need to filter in memory since Firestore doesn't support subcollection queries easily
-        all_rides = await get_all_rides(rides_ref)
-        rider_rides = []
-        
-        for ride in all_rides:
-            if ride.get("riders") and rider_id in ride.get("riders"):
-                rider_rides.append(ride)
-        
-        return rider_rides
+        return [ride async for ride in stream_rides_for_rider(rider_id, rides_ref, ride_store)]
     except Exception as exc:
         raise Exception(f"Error retrieving rider rides: {exc}")
 
-async def get_available_rides(rider_id: str, commute, max_distance: float, rides_ref, commutes_ref):
-    """Get available rides sorted by walking distance"""
+async def stream_rides_for_rider(rider_id: str, rides_ref, ride_store=None):
+    """Yield the rides a rider is part of as a Ride each"""
+    if ride_store is not None and ride_store.ready:
+        for ride_data in ride_store.for_rider(rider_id):
+            ride = _validate_ride(ride_data.get("rideId"), ride_data)
+            if ride is not None:
+                yield ride
+        return
+
+    async for doc in rides_ref.where(RIDER_IDS_FIELD, "array_contains", rider_id).stream():
+        ride = _validate_ride(doc.id, doc.to_dict())
+        if ride is not None:
+            yield ride
+
+async def get_available_rides(rider_id: str, commute, max_distance: float, rides_ref, ride_distances_ref,
+                              ride_store=None, db=None):
+    """Get available rides sorted by walking distance.
+
+    Only the rides with a stored distance for the commute within max_distance
+    are read, so the cost follows the number of matches, not the fleet size.
+    Walking polylines are only read for the rides that pass every filter.
+    """
     try:
-        # Get all active rides with available seats
-        active_rides = rides_ref.where("status", "==", "active").where(
-            "availableSeats", ">", 0).stream()
-        
-        # Create a mapping of ride IDs to their walking distances from the commute
-        # Convert distance from meters to kilometers
-        distance_map = {}
-        if commute.ride_distances:
-            for ride_distance in commute.ride_distances:
-                # Store distance in km (converting from meters)
-                distance_map[ride_distance.ride_id] = ride_distance.distance / 1000
+        # Only the precalculated distances within max_distance (km) are read, without polylines
+        ride_distances = await get_ride_distances(
+            commute.commuteId, ride_distances_ref,
+            max_distance_meters=max_distance * 1000 if max_distance else None
+        )
+        distances_by_ride = {ride_distance.ride_id: ride_distance for ride_distance in ride_distances}
+        if not distances_by_ride:
+            return []
+
+        # Fetch just those rides, from the ride store or in one get_all round trip
+        if ride_store is not None and ride_store.ready:
+            candidates = [
+                (ride_id, dict(ride_data)) for ride_id in distances_by_ride
+                if (ride_data := ride_store.get(ride_id)) is not None
+            ]
+        else:
+            docs = db.get_all(
+                [rides_ref.document(ride_id) for ride_id in distances_by_ride], field_paths=list(Ride.model_fields)
+            )
+            candidates = [(doc.id, doc.to_dict()) async for doc in docs if doc.exists]
         
         rides_with_distance = []
         
-        for ride_doc in active_rides:
-            ride_data = ride_doc.to_dict()
-            ride_id = ride_data.get("rideId")
-            
+        for ride_id, ride_data in candidates:
+            # Only active rides with available seats
+            if ride_data.get("status") != "active" or ride_data.get("availableSeats", 0) <= 0:
+                continue
+
             # Skip rides by the rider themselves
             if ride_data.get("driverId") == rider_id:
                 continue
@@ -203,34 +356,29 @@ async def get_available_rides(rider_id: str, commute, max_distance: float, rides
             # Skip rides the rider is already part of
             if ride_data.get("riders") and rider_id in ride_data.get("riders"):
                 continue
-                
-            # Check if we have a precalculated distance for this ride
-            if ride_id in distance_map:
-                walking_distance = distance_map[ride_id]
-                print(f"Ride {ride_id} has precalculated distance of {walking_distance} km")
-                print(f"Max distance: {max_distance}")
-                # Filter by maximum distance if provided
-                if max_distance and walking_distance > max_distance:
-                    continue
-                
-                # Add distance and route information to the ride data
-                ride_data["walkingDistance"] = walking_distance
-                
-                # Find the corresponding RideDistance object for entry/exit points and routes
-                for ride_distance in commute.ride_distances:
-                    if ride_distance.ride_id == ride_id:
-                        # Add entry and exit points for the map
-                        ride_data["entryPoint"] = ride_distance.entry_point.model_dump() if ride_distance.entry_point else None
-                        ride_data["exitPoint"] = ride_distance.exit_point.model_dump() if ride_distance.exit_point else None
-                        ride_data["entryPolyline"] = ride_distance.entry_polyline
-                        ride_data["exitPolyline"] = ride_distance.exit_polyline
-                        break
-                
-                rides_with_distance.append(ride_data)
+
+            # Skip rides whose days or times can't serve the commute
+            if not schedule_compatible(ride_data, commute):
+                continue
+            
+            # Add distance (in km) and the entry/exit points for the map
+            ride_distance = distances_by_ride[ride_id]
+            ride_data["walkingDistance"] = ride_distance.distance / 1000
+            ride_data["entryPoint"] = ride_distance.entry_point.model_dump() if ride_distance.entry_point else None
+            ride_data["exitPoint"] = ride_distance.exit_point.model_dump() if ride_distance.exit_point else None
+            rides_with_distance.append(ride_data)
+
+        # Then the walking routes, only for the rides that are left
+        if rides_with_distance:
+            polylines = await get_ride_distance_polylines(
+                commute.commuteId, [ride_data["rideId"] for ride_data in rides_with_distance], ride_distances_ref, db
+            )
+            for ride_data in rides_with_distance:
+                ride_data["entryPolyline"], ride_data["exitPolyline"] = polylines.get(ride_data["rideId"], (None, None))
         
         # Sort by walking distance
         rides_with_distance.sort(key=lambda x: x["walkingDistance"])
         
         return rides_with_distance
     except Exception as exc:
-        raise Exception(f"Error retrieving available rides: {exc}")
\ No newline at end of file
+        raise Exception(f"Error retrieving available rides: {exc}")
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+class RideStore:
+    """Process-local copy of the rides collection, kept current by a Firestore snapshot listener.
+
+    The first snapshot loads every ride; later ones apply only the changed documents.
+    Snapshot callbacks arrive on the listener's thread and are handed to the event
+    loop, so the indexes are only ever touched from the loop. Rides are exposed as
+    read-only mappings indexed by rideId, driverId, status and rider membership.
+
+    If the listener stops streaming, the store stops reporting ready, so callers
+    read Firestore instead, and it re-subscribes at most every
+    resubscribe_interval_seconds. The first snapshot of a new listener replaces
+    the whole store, dropping rides removed while it was down.
+    """
+
+    def __init__(self, ride_index=None, resubscribe_interval_seconds=5.0):
+        self.ride_index = ride_index
+        self.resubscribe_interval_seconds = resubscribe_interval_seconds
+        self._rides = {}
+        self._by_driver = {}
+        self._by_status = {}
+        self._by_rider = {}
+        self._ready = asyncio.Event()
+        self._watch = None
+        self._loop = None
+        self._collection = None
+        self._generation = 0
+        self._loaded_generation = None
+        self._subscribed_at = 0.0
+
+    def __len__(self):
+        return len(self._rides)
+
+    @property
+    def ready(self):
+        """Whether a snapshot has been loaded and the listener is still streaming"""
+        if self._watch is None:
+            return False
+        if not self._watch.is_active:
+            self._resubscribe()
+            return False
+        return self._ready.is_set()
+
+    def start(self, rides_collection, loop):
+        """Listen to a synchronous rides collection reference; changes are applied on loop"""
+        self._loop = loop
+        self._collection = rides_collection
+        self._subscribe()
+
+    def _subscribe(self):
+        self._generation += 1
+        generation = self._generation
+        self._subscribed_at = time.monotonic()
+        self._watch = self._collection.on_snapshot(
+            lambda collection_snapshot, changes, read_time: self._on_snapshot(generation, collection_snapshot, changes)
+        )
+
+    def _resubscribe(self):
+        if time.monotonic() - self._subscribed_at < self.resubscribe_interval_seconds:
+            return
+        logger.warning("Ride store listener stopped streaming, re-subscribing")
+        self._ready.clear()
+        try:
+            self._watch.unsubscribe()
+        except Exception as e:
+            logger.warning(f"Error closing the stopped ride store listener: {e}")
+        self._subscribe()
+
+    async def wait_ready(self, timeout):
+        await asyncio.wait_for(self._ready.wait(), timeout)
+
+    def stop(self):
+        if self._watch is not None:
+            self._generation += 1
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def get(self, ride_id):
+        return self._rides.get(ride_id)
+
+    def items(self):
+        """(rideId, ride) pairs of every ride, ordered by rideId"""
+        return sorted(self._rides.items())
+
+    def by_driver(self, driver_id):
+        return self._select(self._by_driver.get(driver_id, ()))
+
+    def by_status(self, status):
+        return self._select(self._by_status.get(status, ()))
+
+    def for_rider(self, rider_id):
+        return self._select(self._by_rider.get(rider_id, ()))
+
+    def _select(self, ride_ids):
+        return [self._rides[ride_id] for ride_id in sorted(ride_ids)]
+
+    def _on_snapshot(self, generation, collection_snapshot, changes):
+        # Runs on the listener thread: copy what we need and apply it on the loop
+        updates = [
+            (change.type.name, change.document.id, change.document.to_dict() if change.type.name != "REMOVED" else None)
+            for change in changes
+        ]
+        # Until this listener's first snapshot is applied, the IDs of the whole collection come along
+        snapshot_ids = None
+        if self._loaded_generation != generation:
+            snapshot_ids = {doc.id for doc in collection_snapshot}
+        self._loop.call_soon_threadsafe(self._apply, generation, updates, snapshot_ids)
+
+    def _apply(self, generation, updates, snapshot_ids):
+        if generation != self._generation:
+            return
+        if self._loaded_generation != generation:
+            # First snapshot of this listener: drop rides removed while no listener was streaming
+            for ride_id in set(self._rides) - snapshot_ids:
+                self._remove(ride_id)
+            self._loaded_generation = generation
+        for change_type, ride_id, ride_data in updates:
+            if change_type == "REMOVED":
+                self._remove(ride_id)
+            else:
+                self._put(ride_id, ride_data)
+        self._ready.set()
+
+    def _put(self, ride_id, ride_data):
+        self._remove(ride_id)
+        self._rides[ride_id] = MappingProxyType(ride_data)
+        self._by_driver.setdefault(ride_data.get("driverId"), set()).add(ride_id)
+        self._by_status.setdefault(ride_data.get("status"), set()).add(ride_id)
+        for rider_id in ride_data.get("riders") or {}:
+            self._by_rider.setdefault(rider_id, set()).add(ride_id)
+        if self.ride_index is not None:
+            self.ride_index.add_ride(ride_id, ride_data)
+
+    def _remove(self, ride_id):
+        ride_data = self._rides.pop(ride_id, None)
+        if ride_data is None:
+            return
+        self._discard(self._by_driver, ride_data.get("driverId"), ride_id)
+        self._discard(self._by_status, ride_data.get("status"), ride_id)
+        for rider_id in ride_data.get("riders") or {}:
+            self._discard(self._by_rider, rider_id, ride_id)
+        if self.ride_index is not None:
+            self.ride_index.remove_ride(ride_id)
+
+    @staticmethod
+    def _discard(index, key, ride_id):
+        ride_ids = index.get(key)
+        if ride_ids:
+            ride_ids.discard(ride_id)
+            if not ride_ids:
+                del index[key]
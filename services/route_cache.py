@@ -0,0 +1,114 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class RouteCache:
+    """Cache for Routes API results keyed on travel mode and quantized coordinates.
+
+    An in-memory LRU sits in front of a SQLite file so results survive restarts.
+    Entries expire ttl_seconds after they were written.
+    """
+
+    def __init__(self, path, precision=5, ttl_seconds=7 * 24 * 3600, max_memory_entries=10000):
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM routes WHERE expires_at <= ?", (time.time(),))
+        self._conn.commit()
+
+    def key(self, kind, mode, origin_coord, destination_coord):
+        p = self.precision
+        return (
+            f"{kind}:{mode}:"
+            f"{origin_coord[0]:.{p}f},{origin_coord[1]:.{p}f}:"
+            f"{destination_coord[0]:.{p}f},{destination_coord[1]:.{p}f}"
+        )
+
+    async def get(self, key):
+        return (await self.get_many([key])).get(key)
+
+    async def set(self, key, value):
+        await self.set_many({key: value})
+
+    async def get_many(self, keys):
+        """Return {key: value} for the keys that are cached and not expired"""
+        now = time.time()
+        found = {}
+        missing = []
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry and entry[1] > now:
+                self._memory.move_to_end(key)
+                found[key] = entry[0]
+            else:
+                missing.append(key)
+
+        if missing:
+            rows = await asyncio.to_thread(self._read_rows, missing, now)
+            for key, value, expires_at in rows:
+                value = json.loads(value)
+                self._remember(key, value, expires_at)
+                found[key] = value
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set_many(self, values):
+        if not values:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        for key, value in values.items():
+            self._remember(key, value, expires_at)
+        rows = [(key, json.dumps(value), expires_at) for key, value in values.items()]
+        await asyncio.to_thread(self._write_rows, rows)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_rows(self, keys, now):
+        rows = []
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._conn.execute(
+                    f"SELECT key, value, expires_at FROM routes WHERE key IN ({placeholders}) AND expires_at > ?",
+                    (*chunk, now)
+                ).fetchall())
+        return rows
+
+    def _write_rows(self, rows):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO routes (key, value, expires_at) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
@@ -0,0 +1,95 @@
+import asyncio
+import random
+import time
+from google.api_core import exceptions
+from . import metrics
+
+# gRPC failures worth another attempt: quota, transient unavailability and timeouts
+RETRYABLE_ERRORS = (
+    exceptions.ResourceExhausted,
+    exceptions.TooManyRequests,
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.Aborted,
+    exceptions.InternalServerError,
+)
+
+class RoutingUnavailableError(Exception):
+    """The Routes API kept failing with retryable errors after every retry"""
+
+class TokenBucket:
+    """Token bucket limiting how many calls start per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class QuotaAwareRoutesClient:
+    """Wraps RoutesAsyncClient to stay under the Routes API quota.
+
+    Calls are capped at max_in_flight concurrent requests and qps starts per second.
+    Retryable errors are retried with jittered exponential backoff, and each attempt
+    gets a deadline. Once retries run out, RoutingUnavailableError is raised.
+    """
+
+    def __init__(self, client, max_in_flight=16, qps=50.0, burst=50, max_retries=4,
+                 backoff_base_seconds=0.5, backoff_max_seconds=8.0, deadline_seconds=10.0):
+        self._client = client
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._bucket = TokenBucket(qps, burst)
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.deadline_seconds = deadline_seconds
+
+    async def compute_routes(self, request, metadata=()):
+        return await self._call(
+            lambda: self._client.compute_routes(
+                request=request, metadata=metadata, retry=None, timeout=self.deadline_seconds
+            )
+        )
+
+    async def compute_route_matrix(self, request, metadata=()):
+        async def consume():
+            stream = await self._client.compute_route_matrix(
+                request=request, metadata=metadata, retry=None, timeout=self.deadline_seconds
+            )
+            return [element async for element in stream]
+
+        # The stream is read inside the retry loop so mid-stream failures are retried too
+        elements = await self._call(consume)
+        return _replay(elements)
+
+    async def _call(self, fn):
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            try:
+                async with self._semaphore:
+                    return await asyncio.wait_for(fn(), self.deadline_seconds)
+            except (*RETRYABLE_ERRORS, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    metrics.increment("routes_api.unavailable")
+                    raise RoutingUnavailableError(
+                        f"Routes API unavailable after {attempt + 1} attempts: {type(e).__name__} - {e}"
+                    ) from e
+                metrics.increment("routes_api.retries")
+                backoff = min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, backoff))
+
+async def _replay(elements):
+    for element in elements:
+        yield element
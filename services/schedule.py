@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from config import settings
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_WEEKDAY_BITS = {weekday[:3]: 1 << index for index, weekday in enumerate(WEEKDAYS)}
+MINUTES_PER_DAY = 24 * 60
+
+def weekday_mask(days):
+    """Bitmask of weekdays, bit 0 for Monday. Names match on their first three letters.
+
+    Returns 0 when no day is recognised, which callers treat as "unknown".
+    """
+    mask = 0
+    for day in days or ():
+        mask |= _WEEKDAY_BITS.get(str(day).strip().lower()[:3], 0)
+    return mask
+
+def as_utc(value):
+    """A datetime or ISO 8601 string as an aware UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    # Naive datetimes are stored by Firestore as UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _minutes_of_day(value):
+    value = as_utc(value)
+    return value.hour * 60 + value.minute
+
+def _windows_overlap(start_a, end_a, start_b, end_b):
+    """Whether two time-of-day windows in minutes overlap, either may cross midnight"""
+    if end_a < start_a:
+        end_a += MINUTES_PER_DAY
+    if end_b < start_b:
+        end_b += MINUTES_PER_DAY
+    return any(
+        start_a + shift <= end_b and start_b <= end_a + shift
+        for shift in (-MINUTES_PER_DAY, 0, MINUTES_PER_DAY)
+    )
+
+def schedule_compatible(ride_data, commute, tolerance_minutes=None):
+    """Whether a ride runs on one of the commute's days within its preferred time window.
+
+    A ride without daysOfWeek runs on the day of its startTime. The commute's
+    window is widened by tolerance_minutes on both sides. Missing or unreadable
+    schedule data never excludes a ride.
+    """
+    if tolerance_minutes is None:
+        tolerance_minutes = settings.SCHEDULE_TOLERANCE_MINUTES
+    try:
+        ride_start = ride_data.get("startTime")
+        ride_end = ride_data.get("endTime") or ride_start
+        if ride_start is None:
+            return True
+
+        commute_days = weekday_mask(commute.daysOfWeek)
+        if ride_data.get("daysOfWeek"):
+            ride_days = weekday_mask(ride_data["daysOfWeek"])
+        else:
+            ride_days = 1 << as_utc(ride_start).weekday()
+        if commute_days and ride_days and not commute_days & ride_days:
+            return False
+
+        return _windows_overlap(
+            _minutes_of_day(ride_start), _minutes_of_day(ride_end),
+            _minutes_of_day(commute.preferredStartTime) - tolerance_minutes,
+            _minutes_of_day(commute.preferredEndTime) + tolerance_minutes
+        )
+    except (TypeError, ValueError, AttributeError):
+        return True
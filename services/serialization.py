@@ -0,0 +1,7 @@
+from typing import List
+from pydantic import TypeAdapter
+from models import Ride, RideRequest
+
+# Built once: a TypeAdapter compiles its validator and serializer on creation
+RIDE_LIST_ADAPTER = TypeAdapter(List[Ride])
+RIDE_REQUEST_LIST_ADAPTER = TypeAdapter(List[RideRequest])
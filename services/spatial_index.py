@@ -0,0 +1,145 @@
+import math
+import numpy as np
+from .helpers import sample_polyline_array
+from .ride_geometry import load_ride_geometry
+
+METERS_PER_DEGREE = 111320.0
+
+class RideSpatialIndex:
+    """Grid index over sampled ride polylines.
+
+    Each ride is registered in every grid cell one of its sample points falls in,
+    so finding rides near a point only looks at the cells around it. Rides without
+    a polyline can't be placed on the grid and are always returned as candidates.
+    """
+
+    def __init__(self, cell_size_meters=500, sampling_distance_meters=100):
+        self.cell_size_degrees = cell_size_meters / METERS_PER_DEGREE
+        self.sampling_distance_meters = sampling_distance_meters
+        self._cells = {}
+        self._ride_cells = {}
+        self._bboxes = {}
+        self._unplaced = set()
+
+    def __len__(self):
+        return len(self._ride_cells) + len(self._unplaced)
+
+    def add_ride(self, ride_id, ride_data):
+        """Index a ride document, replacing any previous entry for it"""
+        self.remove_ride(ride_id)
+        if ride_data.get("status") == "cancelled":
+            return
+
+        coords, _ = load_ride_geometry(ride_data, self.sampling_distance_meters)
+        if len(coords) == 0:
+            self._unplaced.add(ride_id)
+            return
+
+        cells = set(map(tuple, np.floor(coords / self.cell_size_degrees).astype(np.int64).tolist()))
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(ride_id)
+        self._ride_cells[ride_id] = cells
+        min_lat, min_lng = coords.min(axis=0).tolist()
+        max_lat, max_lng = coords.max(axis=0).tolist()
+        self._bboxes[ride_id] = (min_lat, min_lng, max_lat, max_lng)
+
+    def remove_ride(self, ride_id):
+        self._unplaced.discard(ride_id)
+        self._bboxes.pop(ride_id, None)
+        for cell in self._ride_cells.pop(ride_id, ()):
+            rides = self._cells.get(cell)
+            if rides:
+                rides.discard(ride_id)
+                if not rides:
+                    del self._cells[cell]
+
+    def rides_near(self, coord, radius_meters):
+        """Ride IDs with a sample point in a grid cell within radius_meters of coord"""
+        lat, lng = coord
+        lat_span = radius_meters / METERS_PER_DEGREE
+        lng_span = radius_meters / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        min_lat, min_lng = self._cell((lat - lat_span, lng - lng_span))
+        max_lat, max_lng = self._cell((lat + lat_span, lng + lng_span))
+
+        found = set()
+        for i in range(min_lat, max_lat + 1):
+            for j in range(min_lng, max_lng + 1):
+                found.update(self._cells.get((i, j), ()))
+
+        return {
+            ride_id for ride_id in found
+            if self._bboxes[ride_id][0] - lat_span <= lat <= self._bboxes[ride_id][2] + lat_span
+            and self._bboxes[ride_id][1] - lng_span <= lng <= self._bboxes[ride_id][3] + lng_span
+        } | self._unplaced
+
+    def candidates(self, start_coord, end_coord, radius_meters):
+        """Ride IDs passing within radius_meters of both the start and the end"""
+        return self.rides_near(start_coord, radius_meters) & self.rides_near(end_coord, radius_meters)
+
+    def _cell(self, coord):
+        return (math.floor(coord[0] / self.cell_size_degrees), math.floor(coord[1] / self.cell_size_degrees))
+
+class CommuteEndpointIndex:
+    """Grid index of commute start and end points.
+
+    Answers the reverse question of RideSpatialIndex: which commutes have both
+    ends within walking range of a given ride's route.
+    """
+
+    def __init__(self, cell_size_meters=500, sampling_distance_meters=100):
+        self.cell_size_degrees = cell_size_meters / METERS_PER_DEGREE
+        self.sampling_distance_meters = sampling_distance_meters
+        self._start_cells = {}
+        self._end_cells = {}
+        self._commute_cells = {}
+
+    def __len__(self):
+        return len(self._commute_cells)
+
+    def add_commute(self, commute_id, start_coord, end_coord):
+        """Index a commute's endpoints, replacing any previous entry for it"""
+        self.remove_commute(commute_id)
+        start_cell = self._cell(start_coord)
+        end_cell = self._cell(end_coord)
+        self._start_cells.setdefault(start_cell, set()).add(commute_id)
+        self._end_cells.setdefault(end_cell, set()).add(commute_id)
+        self._commute_cells[commute_id] = (start_cell, end_cell)
+
+    def remove_commute(self, commute_id):
+        cells = self._commute_cells.pop(commute_id, None)
+        if not cells:
+            return
+        for grid, cell in ((self._start_cells, cells[0]), (self._end_cells, cells[1])):
+            commutes = grid.get(cell)
+            if commutes:
+                commutes.discard(commute_id)
+                if not commutes:
+                    del grid[cell]
+
+    def commutes_near_ride(self, ride_data, radius_meters):
+        """Commute IDs whose start and end both lie within radius_meters of the ride's route"""
+        if ride_data.get("ridePolyline"):
+            coords, _ = load_ride_geometry(ride_data, self.sampling_distance_meters)
+        else:
+            # No route yet: assume a straight line between the ride's endpoints
+            start = ride_data.get("startLocation") or {}
+            end = ride_data.get("endLocation") or {}
+            if None in (start.get("latitude"), start.get("longitude"), end.get("latitude"), end.get("longitude")):
+                return set()
+            coords = [(start["latitude"], start["longitude"]), (end["latitude"], end["longitude"])]
+            coords, _ = sample_polyline_array(coords, self.sampling_distance_meters)
+
+        covered = set()
+        for lat, lng in coords.tolist():
+            lat_span = radius_meters / METERS_PER_DEGREE
+            lng_span = radius_meters / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+            min_lat, min_lng = self._cell((lat - lat_span, lng - lng_span))
+            max_lat, max_lng = self._cell((lat + lat_span, lng + lng_span))
+            covered.update((i, j) for i in range(min_lat, max_lat + 1) for j in range(min_lng, max_lng + 1))
+
+        starts = set().union(*(self._start_cells.get(cell, ()) for cell in covered))
+        ends = set().union(*(self._end_cells.get(cell, ()) for cell in covered))
+        return starts & ends
+
+    def _cell(self, coord):
+        return (math.floor(coord[0] / self.cell_size_degrees), math.floor(coord[1] / self.cell_size_degrees))
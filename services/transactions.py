@@ -0,0 +1,41 @@
+import asyncio
+import random
+from google.api_core import exceptions
+from google.cloud.firestore import async_transactional
+from config import settings
+from . import metrics
+
+class TransactionContentionError(Exception):
+    """A transaction kept being aborted by concurrent writers until it ran out of attempts"""
+
+def _is_contention(exc):
+    # The client reports an aborted commit as a ValueError caused by Aborted
+    return isinstance(exc, exceptions.Aborted) or isinstance(exc.__cause__, exceptions.Aborted)
+
+async def run_transaction(db, fn, name, *args):
+    """Run fn(transaction, *args) in a Firestore transaction, retrying on contention.
+
+    Each attempt is a fresh single-attempt transaction, so aborted reads and
+    commits are both retried, with jittered exponential backoff in between.
+    Commits, retries and give-ups are counted under transactions.<name>.
+    """
+    for attempt in range(settings.TRANSACTION_MAX_ATTEMPTS):
+        transaction = db.transaction(max_attempts=1)
+        try:
+            result = await async_transactional(fn)(transaction, *args)
+        except Exception as exc:
+            if not _is_contention(exc):
+                raise
+            if attempt == settings.TRANSACTION_MAX_ATTEMPTS - 1:
+                metrics.increment(f"transactions.{name}.contention_failures")
+                raise TransactionContentionError(
+                    f"Transaction {name} aborted by concurrent updates {attempt + 1} times, try again"
+                ) from exc
+            metrics.increment(f"transactions.{name}.retries")
+            backoff = min(
+                settings.TRANSACTION_BACKOFF_MAX_SECONDS, settings.TRANSACTION_BACKOFF_BASE_SECONDS * 2 ** attempt
+            )
+            await asyncio.sleep(random.uniform(0, backoff))
+        else:
+            metrics.increment(f"transactions.{name}.committed")
+            return result
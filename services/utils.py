@@ -1,9 +1,53 @@
 import asyncio
 from google.maps import routing_v2
 from google.type import latlng_pb2
-from .helpers import decode_polyline, sample_points_along_polyline
+from config import settings
+from .routes_client import RoutingUnavailableError
+from .helpers import (
+    decode_polyline_array, sample_polyline_array, nearest_candidates, best_entry_exit_pair
+)
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into a single in-flight call.
+
+    The first caller for a key starts the call; callers arriving before it finishes
+    await the same task and receive its result or exception. Nothing is kept once
+    the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # Shield so one cancelled waiter doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter was cancelled
+
+_inflight = SingleFlight()
+
+def _flight_key(kind, mode, origin_coord, destination_coord):
+    return (kind, mode, tuple(origin_coord), tuple(destination_coord))
+
+def _waypoint(coord):
+    return routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=coord[0], longitude=coord[1])))
+
+async def get_driving_route_polyline(client, origin_coord, destination_coord, cache=None):
+    if cache:
+        cache_key = cache.key("polyline", "DRIVE", origin_coord, destination_coord)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-async def get_driving_route_polyline(client, origin_coord, destination_coord):
     origin = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=origin_coord[0], longitude=origin_coord[1])))
     destination = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=destination_coord[0], longitude=destination_coord[1])))
 
@@ -16,17 +60,31 @@ async def get_driving_route_polyline(client, origin_coord, destination_coord):
     metadata = (("x-goog-fieldmask", field_mask),)
 
     try:
-        response = await client.compute_routes(request=request, metadata=metadata)
+        response = await _inflight.do(
+            _flight_key("polyline", "DRIVE", origin_coord, destination_coord),
+            lambda: client.compute_routes(request=request, metadata=metadata)
+        )
         if response.routes:
-            return response.routes[0].polyline.encoded_polyline
+            encoded_polyline = response.routes[0].polyline.encoded_polyline
+            if cache:
+                await cache.set(cache_key, encoded_polyline)
+            return encoded_polyline
         else:
             print("Warning: No driving route found between A and B.")
             return None
+    except RoutingUnavailableError:
+        raise
     except Exception as e:
         print(f"Error getting driving route polyline: {type(e).__name__} - {e}")
         return None
     
-async def get_walking_route_polyline(client, origin_coord, destination_coord):
+async def get_walking_route_polyline(client, origin_coord, destination_coord, cache=None):
+    if cache:
+        cache_key = cache.key("polyline", "WALK", origin_coord, destination_coord)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     origin = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=origin_coord[0], longitude=origin_coord[1])))
     destination = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=destination_coord[0], longitude=destination_coord[1])))
 
@@ -39,84 +97,167 @@ async def get_walking_route_polyline(client, origin_coord, destination_coord):
     metadata = (("x-goog-fieldmask", field_mask),)
 
     try:
-        response = await client.compute_routes(request=request, metadata=metadata)
+        response = await _inflight.do(
+            _flight_key("polyline", "WALK", origin_coord, destination_coord),
+            lambda: client.compute_routes(request=request, metadata=metadata)
+        )
         if response.routes:
-            return response.routes[0].polyline.encoded_polyline
+            encoded_polyline = response.routes[0].polyline.encoded_polyline
+            if cache:
+                await cache.set(cache_key, encoded_polyline)
+            return encoded_polyline
         else:
             print("Warning: No driving route found between A and B.")
             return None
+    except RoutingUnavailableError:
+        raise
     except Exception as e:
         print(f"Error getting driving route polyline: {type(e).__name__} - {e}")
         return None
 
-async def get_walking_distance(client, origin_coord, destination_coord):
-    origin = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=origin_coord[0], longitude=origin_coord[1])))
-    destination = routing_v2.Waypoint(location=routing_v2.Location(lat_lng=latlng_pb2.LatLng(latitude=destination_coord[0], longitude=destination_coord[1])))
-
-    request = routing_v2.ComputeRoutesRequest(
-        origin=origin,
-        destination=destination,
+async def _fetch_walking_matrix_chunk(client, origin_coords, destination_coords, metadata):
+    """One ComputeRouteMatrix call; returns (origin_index, destination_index, distance) for pairs with a route"""
+    request = routing_v2.ComputeRouteMatrixRequest(
+        origins=[routing_v2.RouteMatrixOrigin(waypoint=_waypoint(c)) for c in origin_coords],
+        destinations=[routing_v2.RouteMatrixDestination(waypoint=_waypoint(c)) for c in destination_coords],
         travel_mode=routing_v2.RouteTravelMode.WALK
     )
-    field_mask = "routes.distanceMeters"
+    elements = []
+    stream = await client.compute_route_matrix(request=request, metadata=metadata)
+    async for element in stream:
+        if element.status.code != 0:
+            continue
+        if element.condition != routing_v2.RouteMatrixElementCondition.ROUTE_EXISTS:
+            continue
+        elements.append((element.origin_index, element.destination_index, element.distance_meters))
+    return elements
+
+async def get_walking_distance_matrix(client, origin_coords, destination_coords, cache=None):
+    """Walking distances in meters for every origin/destination pair, batched through ComputeRouteMatrix.
+
+    Requests are chunked so that no single call exceeds ROUTE_MATRIX_MAX_ELEMENTS elements.
+    Pairs already in the cache are not requested again; pairs without a route
+    (or whose chunk failed) are left as inf.
+    """
+    distances = [[float('inf')] * len(destination_coords) for _ in origin_coords]
+    if not origin_coords or not destination_coords:
+        return distances
+
+    if cache:
+        keys = {
+            (o, d): cache.key("distance", "WALK", origin_coords[o], destination_coords[d])
+            for o in range(len(origin_coords)) for d in range(len(destination_coords))
+        }
+        cached = await cache.get_many(list(keys.values()))
+        for (o, d), key in keys.items():
+            if key in cached:
+                distances[o][d] = cached[key]
+        # Only request the origins and destinations that still have a missing pair
+        missing_origins = sorted({o for (o, d), key in keys.items() if key not in cached})
+        missing_destinations = sorted({d for (o, d), key in keys.items() if key not in cached})
+    else:
+        missing_origins = list(range(len(origin_coords)))
+        missing_destinations = list(range(len(destination_coords)))
+    if not missing_origins:
+        return distances
+
+    max_elements = settings.ROUTE_MATRIX_MAX_ELEMENTS
+    origins_per_chunk = max(1, min(len(missing_origins), max_elements))
+    destinations_per_chunk = max(1, max_elements // origins_per_chunk)
+    field_mask = "originIndex,destinationIndex,status,condition,distanceMeters"
     metadata = (("x-goog-fieldmask", field_mask),)
+    fetched = {}
 
-    try:
-        response = await client.compute_routes(request=request, metadata=metadata)
-        if response.routes and hasattr(response.routes[0], 'distance_meters'):
-            return response.routes[0].distance_meters
-        else:
-            return float('inf')
-    except Exception as e:
-        print(f"Error getting walking distance from {origin_coord} to {destination_coord}: {type(e).__name__} - {e}")
-        return float('inf')
+    for o_start in range(0, len(missing_origins), origins_per_chunk):
+        o_chunk = missing_origins[o_start:o_start + origins_per_chunk]
+        for d_start in range(0, len(missing_destinations), destinations_per_chunk):
+            d_chunk = missing_destinations[d_start:d_start + destinations_per_chunk]
+            chunk_origins = [origin_coords[o] for o in o_chunk]
+            chunk_destinations = [destination_coords[d] for d in d_chunk]
+            try:
+                elements = await _inflight.do(
+                    _flight_key("matrix", "WALK", map(tuple, chunk_origins), map(tuple, chunk_destinations)),
+                    lambda: _fetch_walking_matrix_chunk(client, chunk_origins, chunk_destinations, metadata)
+                )
+                for origin_index, destination_index, distance in elements:
+                    o = o_chunk[origin_index]
+                    d = d_chunk[destination_index]
+                    distances[o][d] = distance
+                    if cache:
+                        fetched[keys[(o, d)]] = distance
+            except RoutingUnavailableError:
+                raise
+            except Exception as e:
+                print(f"Error getting walking distance matrix ({len(o_chunk)}x{len(d_chunk)}): {type(e).__name__} - {e}")
+
+    if cache:
+        await cache.set_many(fetched)
+    return distances
 
-async def find_closest_points_on_route_by_walking(request,
+async def get_walking_distances_from(client, origin_coord, destination_coords, cache=None):
+    """Walking distances from one origin to each destination"""
+    return (await get_walking_distance_matrix(client, [origin_coord], destination_coords, cache))[0]
+
+async def get_walking_distances_to(client, origin_coords, destination_coord, cache=None):
+    """Walking distances from each origin to one destination"""
+    matrix = await get_walking_distance_matrix(client, origin_coords, [destination_coord], cache)
+    return [row[0] for row in matrix]
+
+async def find_closest_points_on_route_by_walking(app,
     origin_A_coord,
     destination_B_coord,
     origin_X_coord,
     destination_Y_coord,
     encoded_polyline,
-    sampling_distance_meters=100 # Sample approx every 100 meters
+    sampling_distance_meters=100, # Sample approx every 100 meters
+    max_candidates=None,
+    max_straight_line_meters=None,
+    sampled_route=None # Pre-sampled (points, distances) of encoded_polyline, skips decoding
 ):
-    client = request.app.state.routes_client
+    client = app.state.routes_client
+    cache = app.state.route_cache
+    if max_candidates is None:
+        max_candidates = settings.WALK_CANDIDATES_PER_SIDE
+    if max_straight_line_meters is None:
+        max_straight_line_meters = settings.WALK_MAX_STRAIGHT_LINE_METERS
+
     if not encoded_polyline:
         try:
-            encoded_polyline = await get_driving_route_polyline(client, origin_A_coord, destination_B_coord)
+            encoded_polyline = await get_driving_route_polyline(client, origin_A_coord, destination_B_coord, cache)
+        except RoutingUnavailableError:
+            raise
         except Exception as e:
             print(f"Error getting driving route polyline: {type(e).__name__} - {e}")
-            return None, None
+            return None, None, float('inf'), None, None
 
-    decoded_coords = decode_polyline(encoded_polyline)
-    sample_coords = sample_points_along_polyline(decoded_coords, sampling_distance_meters)
+    if sampled_route is not None:
+        sample_array, along_route = sampled_route
+    else:
+        decoded_coords = decode_polyline_array(encoded_polyline)
+        sample_array, along_route = sample_polyline_array(decoded_coords, sampling_distance_meters)
+    sample_coords = sample_array.tolist()
     if not sample_coords:
-            return None, None
-    
-    min_total_walk_dist = float('inf')
-    best_entry_point_coord = None
-    best_exit_point_coord = None
-    valid_pairs_evaluated = 0
-
-    tasks_X = [get_walking_distance(client, origin_X_coord, p_coord) for p_coord in sample_coords]
-    walking_distances_X = await asyncio.gather(*tasks_X, return_exceptions=True)
-    tasks_Y = [get_walking_distance(client, p_coord, destination_Y_coord) for p_coord in sample_coords]
-    walking_distances_Y = await asyncio.gather(*tasks_Y, return_exceptions=True)
+        return None, None, float('inf'), None, None
+
+    # Only the sample points closest in straight line get real walking routes
+    entry_candidates = nearest_candidates(sample_array, origin_X_coord, max_candidates, max_straight_line_meters)
+    exit_candidates = nearest_candidates(sample_array, destination_Y_coord, max_candidates, max_straight_line_meters)
+    if not entry_candidates or not exit_candidates:
+        return None, None, float('inf'), None, None
     
-    for i in range(len(walking_distances_X)):
-        if isinstance(walking_distances_X[i], Exception) or walking_distances_X[i] == float('inf'):
-            continue
-        for j in range(len(walking_distances_Y)):
-            if isinstance(walking_distances_Y[j], Exception) or walking_distances_Y[j] == float('inf'):
-                continue
-            current_total_walk_dist = walking_distances_X[i] + walking_distances_Y[j]
-            valid_pairs_evaluated += 1
-            if current_total_walk_dist < min_total_walk_dist:
-                min_total_walk_dist = current_total_walk_dist
-                best_entry_point_coord = sample_coords[i]
-                best_exit_point_coord = sample_coords[j]
+    walking_distances_X = [float('inf')] * len(sample_coords)
+    walking_distances_Y = [float('inf')] * len(sample_coords)
+    entry_distances = await get_walking_distances_from(client, origin_X_coord, [sample_coords[i] for i in entry_candidates], cache)
+    exit_distances = await get_walking_distances_to(client, [sample_coords[j] for j in exit_candidates], destination_Y_coord, cache)
+    for i, distance in zip(entry_candidates, entry_distances):
+        walking_distances_X[i] = distance
+    for j, distance in zip(exit_candidates, exit_distances):
+        walking_distances_Y[j] = distance
     
-    if best_entry_point_coord:
-        return best_entry_point_coord, best_exit_point_coord, min_total_walk_dist, encoded_polyline
-    else:
+    entry_index, exit_index, min_total_walk_dist = best_entry_exit_pair(walking_distances_X, walking_distances_Y)
+    if entry_index is None:
         print("   Could not determine the best entry and exit points.")
-        return None, None, float('inf'), None
\ No newline at end of file
+        return None, None, float('inf'), None, None
+
+    riding_distance = float(along_route[exit_index] - along_route[entry_index])
+    return tuple(sample_coords[entry_index]), tuple(sample_coords[exit_index]), min_total_walk_dist, encoded_polyline, riding_distance
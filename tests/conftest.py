@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings requires these; the tests never reach the services they configure
+os.environ.setdefault("PORT", "8000")
+os.environ.setdefault("DATABASE_URL", "https://example.firebaseio.com")
@@ -0,0 +1,140 @@
+"""handle_ride_requests_bulk against a real AsyncClient and AsyncTransaction.
+
+Only the Firestore RPCs are stubbed, so the client's own get_all, transaction
+and commit code paths run unchanged.
+"""
+import asyncio
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.firestore_v1 import _helpers
+from google.cloud.firestore_v1.async_client import AsyncClient
+from google.cloud.firestore_v1.types import firestore, document, write
+from google.protobuf import timestamp_pb2
+
+from models import RequestDecision, RideRequestStatus
+from services.request_service import handle_ride_requests_bulk
+
+LOCATION = {"latitude": 40.0, "longitude": -3.0}
+
+class FakeFirestoreApi:
+    """Serves documents from a dict keyed by path and records committed writes"""
+
+    def __init__(self, client, documents):
+        self._client = client
+        self.documents = documents
+        self.commits = []
+
+    def _name(self, path):
+        return f"{self._client._database_string}/documents/{path}"
+
+    async def begin_transaction(self, request, metadata=None, **kwargs):
+        return firestore.BeginTransactionResponse(transaction=b"transaction-id")
+
+    async def batch_get_documents(self, request, metadata=None, **kwargs):
+        assert request["transaction"] == b"transaction-id"
+        prefix = self._name("")
+        now = timestamp_pb2.Timestamp(seconds=1)
+
+        async def responses():
+            for name in request["documents"]:
+                path = name[len(prefix):]
+                if path in self.documents:
+                    found = document.Document(
+                        name=name, fields=_helpers.encode_dict(self.documents[path]), create_time=now, update_time=now
+                    )
+                    yield firestore.BatchGetDocumentsResponse(found=found, read_time=now)
+                else:
+                    yield firestore.BatchGetDocumentsResponse(missing=name, read_time=now)
+
+        return responses()
+
+    async def commit(self, request, metadata=None, **kwargs):
+        self.commits.append(request)
+        return firestore.CommitResponse(
+            write_results=[write.WriteResult() for _ in request["writes"]],
+            commit_time=timestamp_pb2.Timestamp(seconds=2)
+        )
+
+    async def rollback(self, request, metadata=None, **kwargs):
+        pass
+
+def ride_request(request_id, rider_id, ride_id="ride1"):
+    return {
+        "requestId": request_id, "rideId": ride_id, "riderId": rider_id, "driverId": "driver1",
+        "status": "pending", "pickupLocation": LOCATION, "dropoffLocation": LOCATION
+    }
+
+def run_bulk(documents, decisions, driver_id="driver1"):
+    client = AsyncClient(project="test", credentials=AnonymousCredentials(), database="rides")
+    api = FakeFirestoreApi(client, documents)
+    client._firestore_api_internal = api
+    results = asyncio.run(handle_ride_requests_bulk(
+        "ride1", driver_id, decisions,
+        client.collection("rides"), client.collection("ride_requests"), client
+    ))
+    return results, api
+
+def committed_writes(api):
+    writes = {}
+    for request in api.commits:
+        for write_pb in request["writes"]:
+            path = write_pb.update.name.split("/documents/", 1)[1]
+            writes[path] = (_helpers.decode_dict(write_pb.update.fields, None), list(write_pb.update_mask.field_paths))
+    return writes
+
+def test_bulk_decisions_commit_in_one_transaction():
+    documents = {
+        "rides/ride1": {"driverId": "driver1", "availableSeats": 1, "riders": {}},
+        "ride_requests/req1": ride_request("req1", "rider1"),
+        "ride_requests/req2": ride_request("req2", "rider2"),
+        "ride_requests/req3": ride_request("req3", "rider3"),
+    }
+    decisions = [
+        RequestDecision(requestId="req1", status=RideRequestStatus.APPROVED),
+        RequestDecision(requestId="req2", status=RideRequestStatus.APPROVED),
+        RequestDecision(requestId="req3", status=RideRequestStatus.REJECTED),
+        RequestDecision(requestId="missing", status=RideRequestStatus.REJECTED),
+    ]
+
+    results, api = run_bulk(documents, decisions)
+
+    assert [(result.requestId, result.success) for result in results] == [
+        ("req1", True), ("req2", False), ("req3", True), ("missing", False)
+    ]
+    assert results[1].message == "No available seats left on this ride"
+    assert len(api.commits) == 1
+
+    writes = committed_writes(api)
+    assert set(writes) == {"rides/ride1", "ride_requests/req1", "ride_requests/req3"}
+    assert writes["ride_requests/req1"][0]["status"] == "approved"
+    assert writes["ride_requests/req3"][0]["status"] == "rejected"
+    ride_fields, ride_mask = writes["rides/ride1"]
+    assert ride_fields["availableSeats"] == 0
+    assert ride_fields["riderIds"] == ["rider1"]
+    assert ride_fields["riders"]["rider1"]["requestId"] == "req1"
+    assert "riders.rider1" in ride_mask
+
+def test_bulk_decisions_refuse_riders_already_on_the_ride():
+    documents = {
+        "rides/ride1": {"driverId": "driver1", "availableSeats": 2, "riders": {"rider1": {"requestId": "old"}}},
+        "ride_requests/req1": ride_request("req1", "rider1"),
+    }
+
+    results, api = run_bulk(documents, [RequestDecision(requestId="req1", status=RideRequestStatus.APPROVED)])
+
+    assert not results[0].success
+    assert results[0].message == "Rider rider1 is already on this ride"
+    assert committed_writes(api) == {}
+
+def test_bulk_decisions_require_the_ride_driver():
+    documents = {
+        "rides/ride1": {"driverId": "driver1", "availableSeats": 2, "riders": {}},
+        "ride_requests/req1": ride_request("req1", "rider1"),
+    }
+
+    try:
+        run_bulk(documents, [RequestDecision(requestId="req1", status=RideRequestStatus.APPROVED)], driver_id="other")
+    except ValueError as e:
+        assert "permission" in str(e)
+    else:
+        raise AssertionError("expected ValueError")
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from services.ride_service import cancel_future_rides
+
+class FakeQuery:
+    """Equality and "in" filters over a dict of documents keyed by ID"""
+
+    def __init__(self, documents, filters=()):
+        self.documents = documents
+        self.filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self.documents, self.filters + ((field, op, value),))
+
+    def document(self, doc_id):
+        return doc_id
+
+    async def stream(self):
+        for doc_id, data in self.documents.items():
+            if all(data.get(field) in value if op == "in" else data.get(field) == value
+                   for field, op, value in self.filters):
+                yield SimpleNamespace(id=doc_id, reference=doc_id, to_dict=lambda data=data: dict(data))
+
+class FakeBatch:
+    def __init__(self, updated):
+        self.updated = updated
+
+    def update(self, ref, updates):
+        self.updated.append(ref)
+
+    async def commit(self):
+        pass
+
+def test_cancel_future_rides_includes_recurring_rides_that_already_started():
+    now = datetime.now(timezone.utc)
+    rides = {
+        "upcoming": {"driverId": "driver1", "status": "active", "startTime": now + timedelta(hours=2)},
+        "recurring": {"driverId": "driver1", "status": "active", "startTime": now - timedelta(days=7),
+                      "daysOfWeek": ["monday", "wednesday"]},
+        "past": {"driverId": "driver1", "status": "active", "startTime": now - timedelta(hours=2)},
+        "other_driver": {"driverId": "driver2", "status": "active", "startTime": now + timedelta(hours=2)},
+    }
+    requests = {
+        "req1": {"rideId": "recurring", "status": "approved"},
+        "req2": {"rideId": "past", "status": "pending"},
+    }
+    updated = []
+    state = SimpleNamespace(db=SimpleNamespace(batch=lambda: FakeBatch(updated)), ride_index=None, commutes_ref=None)
+    request = SimpleNamespace(app=SimpleNamespace(state=state))
+    background_tasks = SimpleNamespace(add_task=lambda *args: None)
+
+    result = asyncio.run(cancel_future_rides(
+        "driver1", FakeQuery(rides), FakeQuery(requests), request, background_tasks
+    ))
+
+    assert sorted(result["cancelled_rides"]) == ["recurring", "upcoming"]
+    assert result["cancelled_requests"] == 1
+    assert sorted(updated) == ["recurring", "req1", "upcoming"]